@@ -1,14 +1,23 @@
-from flask import Flask, render_template, request, jsonify, send_from_directory
+from flask import Flask, render_template, request, jsonify, send_from_directory, Response, stream_with_context
 import os
 import base64
 from PIL import Image
 import io
 import numpy as np
-from plonk import PlonkPipeline
 import requests
 import threading
 import time
 import math
+import sys
+import csv
+import json
+import uuid
+import sqlite3
+import hashlib
+import socket
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
+from requests.adapters import HTTPAdapter
 
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
@@ -30,126 +39,1964 @@ class PLONKConfig:
                 "description": "Entraîné sur Open Street View 5M. Idéal pour images de rues, panneaux, bâtiments. Avantage : Excellent pour géolocalisation urbaine. Limites : Moins adapté aux paysages naturels."
             }
         }
-        self.pipeline = None
-        self.current_model = None
-        self.geocoding_cache = {}  # Cache pour le géocodage
+        # Métriques exposées sur /metrics (histogrammes de latence)
+        self.metrics = Metrics()
+        for name, help_text in (
+            ('plonk_decode_seconds', "Durée du décodage des images"),
+            ('plonk_model_load_seconds', "Durée de chargement d'un modèle"),
+            ('plonk_inference_seconds', "Durée d'un appel au pipeline PLONK (lot complet)"),
+            ('plonk_iteration_seconds', "Durée d'une itération d'analyse"),
+            ('plonk_clustering_seconds', "Durée du regroupement des positions"),
+            ('plonk_geocode_request_seconds', "Durée d'une requête de géocodage par fournisseur"),
+            ('plonk_analysis_seconds', "Durée de traitement d'une analyse (hors file d'attente)")
+        ):
+            self.metrics.histogram(name, help_text)
+        # Pool de pipelines : nombre max de modèles en mémoire et budget mémoire (Mo, 0 = illimité)
+        self.max_loaded_models = int(os.environ.get('PLONK_MAX_LOADED_MODELS', 2))
+        self.model_memory_budget_mb = float(os.environ.get('PLONK_MODEL_MEMORY_BUDGET_MB', 0))
+        # Modèles préchargés en arrière-plan (liste séparée par des virgules, vide = aucun) ;
+        # par défaut ceux de models_info, dans la limite du pool
+        preload = os.environ.get('PLONK_PRELOAD_MODELS')
+        if preload is None:
+            self.preload_models = list(self.models_info)[:self.max_loaded_models]
+        else:
+            self.preload_models = [m.strip() for m in preload.split(',') if m.strip()]
+        # Réglages d'inférence : appareil ('auto', 'cpu', 'cuda'), précision ('fp32', 'bf16', 'fp16'),
+        # torch.inference_mode, torch.compile et tolérance (km) face au fp32 ; surcharges JSON par modèle
+        self.inference_backend = InferenceBackend(
+            create_plonk_pipeline,
+            defaults={
+                'device': os.environ.get('PLONK_DEVICE', 'auto'),
+                'precision': os.environ.get('PLONK_PRECISION', 'fp32'),
+                'inference_mode': os.environ.get('PLONK_INFERENCE_MODE', 'true').lower() in ('1', 'true', 'on', 'yes'),
+                'compile': os.environ.get('PLONK_COMPILE', 'false').lower() in ('1', 'true', 'on', 'yes'),
+                'tolerance_km': float(os.environ.get('PLONK_PRECISION_TOLERANCE_KM', 25))
+            },
+            overrides=json.loads(os.environ.get('PLONK_INFERENCE_OVERRIDES') or '{}'),
+            num_threads=int(os.environ.get('PLONK_TORCH_THREADS', 0)),
+            num_interop_threads=int(os.environ.get('PLONK_TORCH_INTEROP_THREADS', 0)),
+            validation_samples=int(os.environ.get('PLONK_VALIDATION_SAMPLES', 64))
+        )
+        self.model_pool = ModelPool(
+            self.inference_backend.load,
+            max_models=self.max_loaded_models,
+            memory_budget_mb=self.model_memory_budget_mb,
+            metrics=self.metrics
+        )
+        self.model_preloader = ModelPreloader(self.model_pool, self.preload_models)
+        # Regroupement des inférences : taille max d'un lot (échantillons) et attente max (ms)
+        self.max_batch_size = int(os.environ.get('PLONK_MAX_BATCH_SIZE', 1024))
+        self.max_batch_wait_ms = float(os.environ.get('PLONK_MAX_BATCH_WAIT_MS', 10))
+        self.inference_scheduler = InferenceScheduler(
+            self.model_pool.get,
+            max_batch_size=self.max_batch_size,
+            max_wait_ms=self.max_batch_wait_ms,
+            metrics=self.metrics
+        )
+        # Cache pour le géocodage : LRU en mémoire + SQLite sur disque (chemin vide = mémoire seule)
+        self.geocoding_cache = GeocodingCache(
+            db_path=os.environ.get('PLONK_GEOCODE_CACHE_PATH',
+                                   os.path.join(app.instance_path, 'geocoding_cache.sqlite3')),
+            max_memory_entries=int(os.environ.get('PLONK_GEOCODE_CACHE_MEMORY_ENTRIES', 10000)),
+            max_disk_entries=int(os.environ.get('PLONK_GEOCODE_CACHE_DISK_ENTRIES', 1000000)),
+            ttl=float(os.environ.get('PLONK_GEOCODE_CACHE_TTL', 30 * 24 * 3600)),
+            negative_ttl=float(os.environ.get('PLONK_GEOCODE_NEGATIVE_TTL', 120))
+        )
+        # Client de géocodage : fournisseurs par ordre de préférence, débit max (req/s) par fournisseur
+        self.geocoding_client = GeocodingClient(
+            providers=[
+                {'name': 'photon', 'url': os.environ.get('PLONK_PHOTON_URL', 'https://photon.komoot.io'),
+                 'rate': float(os.environ.get('PLONK_PHOTON_RATE', 10))},
+                {'name': 'nominatim', 'url': os.environ.get('PLONK_NOMINATIM_URL', 'https://nominatim.openstreetmap.org'),
+                 'rate': float(os.environ.get('PLONK_NOMINATIM_RATE', 1))}
+            ],
+            timeout=float(os.environ.get('PLONK_GEOCODE_TIMEOUT', 3)),
+            hedge_delay_ms=float(os.environ.get('PLONK_GEOCODE_HEDGE_DELAY_MS', 300)),
+            max_workers=int(os.environ.get('PLONK_GEOCODE_WORKERS', 16)),
+            metrics=self.metrics
+        )
+        # Fusion des géocodages concurrents portant sur la même cellule de cache
+        self.geocoding_coalescer = RequestCoalescer(
+            max_workers=int(os.environ.get('PLONK_GEOCODE_LOOKUP_WORKERS', 16))
+        )
+        # Cache des prédictions brutes par image (Mo en mémoire, répertoire et Mo sur disque optionnels)
+        self.prediction_cache = PredictionCache(
+            max_memory_mb=float(os.environ.get('PLONK_PREDICTION_CACHE_MB', 256)),
+            cache_dir=os.environ.get('PLONK_PREDICTION_CACHE_DIR') or None,
+            max_disk_mb=float(os.environ.get('PLONK_PREDICTION_CACHE_DISK_MB', 2048))
+        )
+        # Pool de workers pour les analyses : nombre de workers et taille max de la file d'attente.
+        # Chaque worker attend son inférence : par défaut, assez de workers pour remplir un lot
+        # de l'ordonnanceur avec des analyses rapides (65 échantillons)
+        self.analysis_workers = int(os.environ.get('PLONK_ANALYSIS_WORKERS', max(2, self.max_batch_size // 65)))
+        self.analysis_queue_size = int(os.environ.get('PLONK_ANALYSIS_QUEUE_SIZE', 32))
+        self.analysis_pool = AnalysisWorkerPool(
+            num_workers=self.analysis_workers,
+            max_queue=self.analysis_queue_size
+        )
+        # Stockage des analyses : durée de conservation (s), plafonds, base SQLite optionnelle (partagée entre workers)
+        # et délai (s) sans battement de cœur après lequel les jobs non terminés d'un processus arrêté passent en erreur
+        self.job_store = JobStore(
+            ttl=float(os.environ.get('PLONK_JOB_TTL', 3600)),
+            max_jobs=int(os.environ.get('PLONK_MAX_JOBS', 1000)),
+            max_memory_mb=float(os.environ.get('PLONK_JOB_STORE_MB', 128)),
+            db_path=os.environ.get('PLONK_JOB_DB') or None,
+            stale_after=float(os.environ.get('PLONK_JOB_STALE_AFTER', 600))
+        )
+        # Répertoire racine des évaluations lancées par HTTP (non défini = endpoint désactivé)
+        evaluation_root = os.environ.get('PLONK_EVALUATION_ROOT')
+        self.evaluation_root = os.path.realpath(evaluation_root) if evaluation_root else None
+        # Taille max (px) du plus grand côté des images décodées
+        self.max_image_side = int(os.environ.get('PLONK_MAX_IMAGE_SIDE', 1024))
+        # Nombre d'itérations consécutives stables avant l'arrêt anticipé du mode précision
+        self.convergence_patience = int(os.environ.get('PLONK_CONVERGENCE_PATIENCE', 2))
+        self.max_geocoding_batch = int(os.environ.get('PLONK_MAX_GEOCODE_BATCH', 500))
+        # Géocodage hors ligne : 'online' (défaut), 'offline_first' ou 'offline'
+        self.geocoding_backend = os.environ.get('PLONK_GEOCODER', 'online')
+        self.offline_geocoder = None
+        cities_path = os.environ.get('PLONK_OFFLINE_CITIES')
+        if cities_path:
+            try:
+                self.offline_geocoder = OfflineGeocoder(
+                    cities_path,
+                    countries_path=os.environ.get('PLONK_OFFLINE_COUNTRIES'),
+                    admin1_path=os.environ.get('PLONK_OFFLINE_ADMIN1'),
+                    polygons_path=os.environ.get('PLONK_OFFLINE_POLYGONS'),
+                    max_distance_km=float(os.environ.get('PLONK_OFFLINE_MAX_DISTANCE_KM', 50))
+                )
+            except (OSError, ValueError) as e:
+                print(f"Géocodeur hors ligne indisponible: {e}")
 
-config = PLONKConfig()
+class MetricTimer:
+    """Chronomètre une section et l'enregistre dans un histogramme à la sortie du bloc"""
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+        self.elapsed = 0.0
 
-def get_cache_key(lat, lon):
-    """Génère une clé de cache pour les coordonnées (arrondie à ~100m)"""
-    # Arrondir à 3 décimales (~100m de précision) pour le cache
-    rounded_lat = round(lat, 3)
-    rounded_lon = round(lon, 3)
-    return f"{rounded_lat},{rounded_lon}"
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
 
-def try_nominatim(lat, lon):
-    """Essaie le géocodage avec Nominatim"""
-    try:
-        url = f"https://nominatim.openstreetmap.org/reverse?format=json&lat={lat}&lon={lon}&zoom=16&addressdetails=1"
-        headers = {
+    def __exit__(self, exc_type, exc, tb):
+        self.elapsed = time.perf_counter() - self._start
+        if self.metrics is not None:
+            self.metrics.observe(self.name, self.elapsed, **self.labels)
+        return False
+
+class Metrics:
+    """Registre d'histogrammes de latence exposés au format texte Prometheus
+
+    Les compteurs et jauges sont lus à la demande dans les stats() des composants.
+    """
+    DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self):
+        self._histograms = OrderedDict()  # name -> {'help', 'buckets', 'series': {labels -> [counts, sum, count]}}
+        self._lock = threading.Lock()
+
+    def histogram(self, name, help_text, buckets=None):
+        """Déclare un histogramme (les observations sur un nom inconnu sont ignorées)"""
+        with self._lock:
+            self._histograms.setdefault(name, {'help': help_text, 'buckets': tuple(buckets or self.DEFAULT_BUCKETS),
+                                               'series': OrderedDict()})
+
+    def observe(self, name, value, **labels):
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            return
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = histogram['series'].get(key)
+            if series is None:
+                series = histogram['series'][key] = [[0] * len(histogram['buckets']), 0.0, 0]
+            for i, bound in enumerate(histogram['buckets']):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def timer(self, name, **labels):
+        return MetricTimer(self, name, labels)
+
+    @staticmethod
+    def format_labels(labels):
+        if not labels:
+            return ''
+        parts = []
+        for key, value in labels:
+            value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            parts.append(f'{key}="{value}"')
+        return '{' + ','.join(parts) + '}'
+
+    def render(self, samples=()):
+        """Texte d'exposition : histogrammes, puis séries (nom, type, aide, [(labels, valeur)])"""
+        lines = []
+        with self._lock:
+            for name, histogram in self._histograms.items():
+                lines.append(f"# HELP {name} {histogram['help']}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, (counts, total, count) in histogram['series'].items():
+                    for bound, bucket_count in zip(histogram['buckets'], counts):
+                        lines.append(f"{name}_bucket{self.format_labels(key + (('le', repr(float(bound))),))} {bucket_count}")
+                    lines.append(f"{name}_bucket{self.format_labels(key + (('le', '+Inf'),))} {count}")
+                    lines.append(f"{name}_sum{self.format_labels(key)} {total}")
+                    lines.append(f"{name}_count{self.format_labels(key)} {count}")
+        for name, metric_type, help_text, values in samples:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in values:
+                lines.append(f"{name}{self.format_labels(tuple(sorted(labels.items())))} {value}")
+        return '\n'.join(lines) + '\n'
+
+# Types torch correspondant aux précisions d'inférence acceptées
+PRECISION_DTYPES = {'fp32': 'float32', 'bf16': 'bfloat16', 'fp16': 'float16'}
+
+class TunedPipeline:
+    """Enveloppe un PlonkPipeline : inference_mode et autocast appliqués à chaque appel"""
+    def __init__(self, pipeline, device, precision='fp32', inference_mode=True):
+        self.pipeline = pipeline
+        self.device = device
+        self.precision = precision
+        self.inference_mode = inference_mode
+
+    def _run(self, fn):
+        import torch
+        # Les contextes torch sont propres au thread : ils sont ouverts à chaque appel
+        grad_context = torch.inference_mode() if self.inference_mode else torch.no_grad()
+        with grad_context:
+            if self.precision != 'fp32':
+                dtype = getattr(torch, PRECISION_DTYPES[self.precision])
+                with torch.autocast(device_type=self.device.split(':')[0], dtype=dtype):
+                    return fn(torch)
+            return fn(torch)
+
+    @staticmethod
+    def _to_numpy(coords):
+        # Les sorties en demi-précision sont ramenées en float64 pour le post-traitement
+        if hasattr(coords, 'detach'):
+            coords = coords.detach().float().cpu().numpy()
+        return np.asarray(coords, dtype=float)
+
+    def __call__(self, images, batch_size=None, **kwargs):
+        return self._to_numpy(self._run(lambda torch: self.pipeline(images, batch_size=batch_size, **kwargs)))
+
+    def sample_many(self, images, counts):
+        """Tire counts[i] échantillons pour chaque image en un seul passage de l'échantillonneur
+
+        Chaque image est encodée une fois ; son embedding est répété counts[i] fois et toutes
+        les lignes partagent le même appel au sampler. Retourne un tableau (sum(counts), 2)
+        dans l'ordre des images. Sans accès aux étapes internes de PlonkPipeline, repli sur
+        un appel par image.
+        """
+        pipeline = self.pipeline
+        if not all(hasattr(pipeline, name) for name in
+                   ('cond_preprocessing', 'sampler', 'model', 'scheduler', 'postprocessing')):
+            return sample_images(self, images, counts)
+
+        def sample(torch):
+            embeddings = pipeline.cond_preprocessing({'img': list(images)})['emb']
+            repeats = torch.as_tensor(list(counts), device=embeddings.device)
+            batch = {
+                'y': torch.randn(int(sum(counts)), 3, device=pipeline.device),
+                'emb': embeddings.repeat_interleave(repeats, dim=0)
+            }
+            output = pipeline.sampler(pipeline.model, batch, conditioning_keys='emb',
+                                      scheduler=pipeline.scheduler, cfg_rate=0)
+            return pipeline.postprocessing(output)
+
+        # Même post-traitement que PlonkPipeline.__call__ : radians -> degrés
+        return np.degrees(self._to_numpy(self._run(sample)))
+
+    def __getattr__(self, name):
+        return getattr(self.pipeline, name)
+
+def sample_images(pipeline, images, counts):
+    """Repli de sample_many : un appel au pipeline par image, résultats concaténés"""
+    chunks = [np.asarray(pipeline([image], batch_size=count), dtype=float).reshape(-1, 2)
+              for image, count in zip(images, counts)]
+    return np.concatenate(chunks) if chunks else np.empty((0, 2))
+
+class InferenceBackend:
+    """Construit les pipelines PLONK selon les réglages d'inférence (appareil, threads, précision, compilation)"""
+    def __init__(self, factory, defaults=None, overrides=None, num_threads=0, num_interop_threads=0,
+                 validation_samples=64):
+        self.factory = factory
+        self.defaults = {'device': 'auto', 'precision': 'fp32', 'inference_mode': True,
+                         'compile': False, 'tolerance_km': 25.0}
+        self.defaults.update(defaults or {})
+        self.overrides = overrides or {}  # model_id -> réglages remplaçant les valeurs par défaut
+        self.num_threads = num_threads
+        self.num_interop_threads = num_interop_threads
+        self.validation_samples = max(1, validation_samples)
+        self._threads_configured = False
+        self._lock = threading.Lock()
+        self.reports = {}  # model_id -> réglages effectifs et résultat de la validation
+
+    def settings_for(self, model_id):
+        """Réglages d'un modèle : valeurs par défaut puis surcharges propres au modèle"""
+        settings = dict(self.defaults)
+        settings.update(self.overrides.get(model_id, {}))
+        return settings
+
+    def _configure_threads(self, torch):
+        """Fixe les threads intra/inter-op (réglage global au processus, appliqué une seule fois)"""
+        with self._lock:
+            if self._threads_configured:
+                return
+            self._threads_configured = True
+        if self.num_threads > 0:
+            torch.set_num_threads(self.num_threads)
+        if self.num_interop_threads > 0:
+            try:
+                torch.set_num_interop_threads(self.num_interop_threads)
+            except RuntimeError as e:
+                # Impossible une fois le parallélisme inter-op démarré
+                print(f"Threads inter-op non modifiés: {e}")
+
+    def load(self, model_id):
+        """Charge un modèle et applique ses réglages, validés contre une référence fp32"""
+        import torch  # Import différé : torch n'est initialisé qu'au premier chargement de modèle
+        self._configure_threads(torch)
+        settings = self.settings_for(model_id)
+        device = settings['device']
+        if device == 'auto':
+            device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        precision = settings['precision']
+        if precision not in PRECISION_DTYPES:
+            print(f"Précision inconnue pour {model_id}: {precision}, fp32 utilisé")
+            precision = 'fp32'
+
+        pipeline = self.factory(model_id, device=device)
+        reference = TunedPipeline(pipeline, device, 'fp32', settings['inference_mode'])
+        report = {'device': device, 'precision': 'fp32', 'requested_precision': precision,
+                  'inference_mode': settings['inference_mode'], 'compiled': False,
+                  'error_km_p95': None, 'fallback': False}
+        self.reports[model_id] = report
+        if precision == 'fp32' and not settings['compile']:
+            return reference
+
+        # Référence fp32 sur une image de validation, avec le même bruit initial pour les deux variantes
+        probe = self._validation_image()
+        try:
+            expected = self._sample(torch, reference, probe, device)
+        except Exception as e:
+            print(f"Validation impossible pour {model_id}, fp32 utilisé: {e}")
+            report['fallback'] = True
+            return reference
+
+        network = getattr(pipeline, 'network', None)
+        error_km = None
+        compiled = False
+        try:
+            if settings['compile'] and network is not None:
+                pipeline.network = torch.compile(network)
+                compiled = True
+            candidate = TunedPipeline(pipeline, device, precision, settings['inference_mode'])
+            # Le premier appel sert aussi de préchauffage pour torch.compile
+            actual = self._sample(torch, candidate, probe, device)
+            distances = haversine_km(expected[:, 0], expected[:, 1], actual[:, 0], actual[:, 1])
+            error_km = float(np.percentile(distances, 95))
+        except Exception as e:
+            print(f"Réglages d'inférence rejetés pour {model_id}: {e}")
+
+        if error_km is not None and error_km <= settings['tolerance_km']:
+            report.update(precision=precision, compiled=compiled, error_km_p95=round(error_km, 3))
+            print(f"Inférence {model_id}: {device}, {precision}, écart p95 {error_km:.3f} km")
+            return candidate
+
+        # Écart hors tolérance ou échec : retour au pipeline fp32 non compilé
+        if network is not None:
+            pipeline.network = network
+        report.update(error_km_p95=round(error_km, 3) if error_km is not None else None, fallback=True)
+        print(f"Inférence {model_id}: retour en fp32 (écart p95: {error_km} km)")
+        return reference
+
+    def _validation_image(self):
+        """Image synthétique déterministe (dégradé) utilisée pour comparer les précisions"""
+        ramp = np.linspace(0, 255, 224, dtype=np.uint8)
+        pixels = np.stack([np.tile(ramp, (224, 1)), np.tile(ramp[:, None], (1, 224)),
+                           np.full((224, 224), 128, dtype=np.uint8)], axis=-1)
+        return Image.fromarray(pixels, 'RGB')
+
+    def _sample(self, torch, pipeline, image, device):
+        """Tire des échantillons avec une graine fixe sans perturber le générateur global"""
+        with torch.random.fork_rng(devices=[] if device == 'cpu' else None):
+            torch.manual_seed(0)
+            return pipeline([image], batch_size=self.validation_samples)
+
+    def sampling_params(self, model_id):
+        """Réglages influant sur les échantillons tirés, pour la clé du cache de prédictions
+
+        Réglages effectifs une fois le modèle chargé (après un éventuel retour en fp32),
+        réglages demandés sinon.
+        """
+        report = self.reports.get(model_id)
+        if report is not None:
+            return (('device', report['device']), ('precision', report['precision']),
+                    ('compiled', report['compiled']))
+        settings = self.settings_for(model_id)
+        return (('device', settings['device']), ('precision', settings['precision']),
+                ('compiled', bool(settings['compile'])))
+
+    def stats(self):
+        """Réglages effectifs de chaque modèle chargé"""
+        return {model_id: dict(report) for model_id, report in self.reports.items()}
+
+def create_plonk_pipeline(model_id, device):
+    """Construit un PlonkPipeline ; plonk (et torch) ne sont importés qu'au premier chargement de modèle"""
+    from plonk import PlonkPipeline
+    return PlonkPipeline(model_id, device=device)
+
+def estimate_pipeline_memory_mb(pipeline):
+    """Estime la mémoire occupée par les poids d'un pipeline (en Mo)"""
+    total_bytes = 0
+    if isinstance(pipeline, TunedPipeline):
+        pipeline = pipeline.pipeline
+    for value in getattr(pipeline, '__dict__', {}).values():
+        parameters = getattr(value, 'parameters', None)
+        if not callable(parameters):
+            continue
+        try:
+            total_bytes += sum(p.numel() * p.element_size() for p in parameters())
+        except Exception:
+            continue
+    return total_bytes / (1024 * 1024)
+
+class ModelPool:
+    """Pool de pipelines PLONK indexé par model_id avec éviction LRU"""
+    def __init__(self, factory, max_models=2, memory_budget_mb=0, metrics=None):
+        self.factory = factory
+        self.metrics = metrics
+        self.max_models = max(1, max_models)
+        self.memory_budget_mb = memory_budget_mb
+        self._pipelines = OrderedDict()  # model_id -> {'pipeline': ..., 'memory_mb': ...}
+        self._lock = threading.Lock()
+        self._load_locks = {}  # Un verrou par modèle pour éviter les chargements concurrents
+        self.loads = 0
+        self.hits = 0
+        self.evictions = 0
+
+    def get(self, model_id):
+        """Retourne le pipeline du modèle, en le chargeant si nécessaire"""
+        with self._lock:
+            entry = self._pipelines.get(model_id)
+            if entry is not None:
+                self._pipelines.move_to_end(model_id)
+                self.hits += 1
+                return entry['pipeline']
+            load_lock = self._load_locks.setdefault(model_id, threading.Lock())
+
+        with load_lock:
+            # Un autre thread a pu charger le modèle pendant l'attente
+            with self._lock:
+                entry = self._pipelines.get(model_id)
+                if entry is not None:
+                    self._pipelines.move_to_end(model_id)
+                    self.hits += 1
+                    return entry['pipeline']
+
+            # Chargement hors du verrou global : les autres modèles restent disponibles
+            with MetricTimer(self.metrics, 'plonk_model_load_seconds', {'model': model_id}):
+                pipeline = self.factory(model_id)
+            memory_mb = estimate_pipeline_memory_mb(pipeline)
+
+            with self._lock:
+                self._pipelines[model_id] = {'pipeline': pipeline, 'memory_mb': memory_mb}
+                self.loads += 1
+                self._evict(keep=model_id)
+            return pipeline
+
+    def _evict(self, keep):
+        """Évince les modèles les moins récemment utilisés (verrou déjà acquis)"""
+        evicted = False
+        while len(self._pipelines) > 1:
+            over_count = len(self._pipelines) > self.max_models
+            over_budget = self.memory_budget_mb > 0 and self._total_memory_mb() > self.memory_budget_mb
+            if not (over_count or over_budget):
+                break
+            oldest = next(iter(self._pipelines))
+            if oldest == keep:
+                break
+            del self._pipelines[oldest]
+            self.evictions += 1
+            evicted = True
+            print(f"Modèle évincé du pool: {oldest}")
+
+        # Libérer la mémoire GPU si torch est déjà chargé
+        torch = sys.modules.get('torch')
+        if evicted and torch is not None and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def _total_memory_mb(self):
+        return sum(entry['memory_mb'] for entry in self._pipelines.values())
+
+    def stats(self):
+        """Retourne l'état du pool et ses compteurs"""
+        with self._lock:
+            return {
+                'loaded_models': list(self._pipelines.keys()),
+                'memory_mb': round(self._total_memory_mb(), 1),
+                'max_models': self.max_models,
+                'memory_budget_mb': self.memory_budget_mb,
+                'loads': self.loads,
+                'hits': self.hits,
+                'evictions': self.evictions
+            }
+
+class ModelPreloader:
+    """Précharge les modèles en arrière-plan et indique quand le service est prêt"""
+    def __init__(self, model_pool, model_ids):
+        self.model_pool = model_pool
+        self.states = OrderedDict((model_id, 'pending') for model_id in model_ids)
+        self.errors = {}
+        self.started_at = time.time()  # Création de la configuration (démarrage du processus)
+        self.ready_at = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self, wait_for_address=None, timeout=30.0):
+        """Lance le préchargement une seule fois ; attend d'abord que l'adresse (hôte, port) accepte les connexions"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, args=(wait_for_address, timeout),
+                                            name='model-preloader', daemon=True)
+            self._thread.start()
+
+    def _run(self, wait_for_address, timeout):
+        if wait_for_address is not None:
+            deadline = time.monotonic() + timeout
+            while time.monotonic() < deadline:
+                try:
+                    socket.create_connection(wait_for_address, timeout=1).close()
+                    break
+                except OSError:
+                    time.sleep(0.05)
+        for model_id in self.states:
+            self.states[model_id] = 'loading'
+            try:
+                self.model_pool.get(model_id)
+                self.states[model_id] = 'ready'
+                print(f"Modèle préchargé: {model_id}")
+            except Exception as e:
+                self.states[model_id] = 'error'
+                self.errors[model_id] = str(e)
+                print(f"Erreur lors du préchargement de {model_id}: {e}")
+        self.ready_at = time.time()
+
+    def is_ready(self):
+        """Prêt lorsque le préchargement est terminé avec au moins un modèle chargé (ou aucun demandé)"""
+        if not self.states:
+            return True
+        return self.ready_at is not None and 'ready' in self.states.values()
+
+    def stats(self):
+        return {
+            'ready': self.is_ready(),
+            'models': dict(self.states),
+            'errors': dict(self.errors),
+            'started': self._thread is not None,
+            'warm_up_seconds': round(self.ready_at - self.started_at, 3) if self.ready_at else None
+        }
+
+class InferenceScheduler:
+    """Regroupe les requêtes en attente par modèle : les images d'un lot partagent un seul
+    passage de l'échantillonneur, et chaque image distincte n'est encodée qu'une fois"""
+    def __init__(self, model_loader, max_batch_size=1024, max_wait_ms=10, metrics=None):
+        self.model_loader = model_loader
+        self.metrics = metrics
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self._pending = {}  # model_id -> liste de requêtes en attente
+        self._workers = {}  # model_id -> thread de traitement
+        self._cond = threading.Condition()
+        self.batches = 0
+        self.requests = 0
+        self.pipeline_calls = 0
+
+    def submit(self, model_id, img, num_samples, key=None):
+        """Ajoute une image à la file du modèle et retourne un Future (tableau (num_samples, 2))
+
+        `key` identifie le contenu de l'image (ex. son empreinte) pour fusionner les requêtes identiques.
+        """
+        future = Future()
+        with self._cond:
+            self._pending.setdefault(model_id, []).append({
+                'image': img,
+                'key': key if key is not None else id(img),
+                'num_samples': max(1, int(num_samples)),
+                'future': future,
+                'enqueued_at': time.monotonic()
+            })
+            if model_id not in self._workers:
+                worker = threading.Thread(target=self._run, args=(model_id,), daemon=True)
+                self._workers[model_id] = worker
+                worker.start()
+            self._cond.notify_all()
+        return future
+
+    def _next_batch(self, model_id):
+        """Attend qu'un lot soit plein ou que le délai max soit écoulé, puis le retire de la file"""
+        with self._cond:
+            queue = self._pending[model_id]
+            while not queue:
+                self._cond.wait()
+            deadline = queue[0]['enqueued_at'] + self.max_wait
+            while True:
+                queued_samples = sum(item['num_samples'] for item in queue)
+                remaining = deadline - time.monotonic()
+                if queued_samples >= self.max_batch_size or remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            # Toujours au moins une requête, même si elle dépasse la taille max du lot (découpée dans _infer)
+            batch = [queue.pop(0)]
+            total = batch[0]['num_samples']
+            while queue and total + queue[0]['num_samples'] <= self.max_batch_size:
+                total += queue[0]['num_samples']
+                batch.append(queue.pop(0))
+            return batch
+
+    def _run(self, model_id):
+        while True:
+            batch = self._next_batch(model_id)
+            try:
+                for item, coords in zip(batch, self._infer(model_id, batch)):
+                    item['future'].set_result(coords)
+            except Exception as e:
+                for item in batch:
+                    if not item['future'].done():
+                        item['future'].set_exception(e)
+
+    def _infer(self, model_id, batch):
+        """Exécute le lot en un minimum de passages ; retourne les tableaux dans l'ordre du lot
+
+        Les requêtes portant sur la même image sont fusionnées, puis toutes les images du lot
+        partagent un même appel sample_many (chaque image encodée une fois, un seul passage
+        de l'échantillonneur). Au-delà de max_batch_size échantillons, le lot est découpé.
+        Un pipeline sans sample_many est appelé une fois par image.
+        """
+        pipeline = self.model_loader(model_id)
+        sample_many = getattr(pipeline, 'sample_many', None)
+        groups = OrderedDict()
+        for item in batch:
+            groups.setdefault(item['key'], []).append(item)
+
+        # Découpage en passages d'au plus max_batch_size échantillons : [(clé, image, nombre), ...]
+        passes, current, room = [], [], self.max_batch_size
+        for key, items in groups.items():
+            remaining = sum(item['num_samples'] for item in items)
+            while remaining > 0:
+                size = min(remaining, room)
+                current.append((key, items[0]['image'], size))
+                remaining -= size
+                room -= size
+                if room == 0:
+                    passes.append(current)
+                    current, room = [], self.max_batch_size
+        if current:
+            passes.append(current)
+
+        pieces = {key: [] for key in groups}
+        calls = 0
+        for segments in passes:
+            images = [image for _, image, _ in segments]
+            counts = [size for _, _, size in segments]
+            with MetricTimer(self.metrics, 'plonk_inference_seconds', {'model': model_id}):
+                if sample_many is not None:
+                    coords = sample_many(images, counts)
+                else:
+                    coords = sample_images(pipeline, images, counts)
+            coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+            if coords.shape[0] < sum(counts):
+                raise ValueError(f"Le pipeline a retourné {coords.shape[0]} points pour {sum(counts)} demandés")
+            offset = 0
+            for key, _, size in segments:
+                pieces[key].append(coords[offset:offset + size])
+                offset += size
+            calls += 1 if sample_many is not None else len(segments)
+
+        results = {}
+        for key, items in groups.items():
+            coords = np.concatenate(pieces[key])
+            offset = 0
+            for item in items:
+                results[id(item['future'])] = coords[offset:offset + item['num_samples']]
+                offset += item['num_samples']
+
+        with self._cond:
+            self.batches += 1
+            self.requests += len(batch)
+            self.pipeline_calls += calls
+        return [results[id(item['future'])] for item in batch]
+
+    def stats(self):
+        with self._cond:
+            return {
+                'batches': self.batches,
+                'requests': self.requests,
+                'pipeline_calls': self.pipeline_calls,
+                'pending': sum(len(queue) for queue in self._pending.values()),
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000
+            }
+
+class GeocodingCache:
+    """Cache de géocodage : LRU en mémoire devant un stockage SQLite persistant
+
+    Les échecs sont mis en cache (cache négatif) avec une expiration courte.
+    """
+    def __init__(self, db_path=None, max_memory_entries=10000, max_disk_entries=1000000,
+                 ttl=30 * 24 * 3600, negative_ttl=120):
+        self.max_memory_entries = max(1, max_memory_entries)
+        self.max_disk_entries = max_disk_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._memory = OrderedDict()  # key -> (value, expires_at) ; value None = échec en cache
+        self._lock = threading.Lock()
+        self._db_path = db_path
+        self._db = None
+        self._db_opened = False
+        self._disk_writes = 0
+        self._pending_access = {}  # key -> date du dernier accès, écrite sur disque par lots
+        self.access_batch = 256
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _connection(self):
+        """Ouvre la base SQLite au premier usage (verrou déjà acquis)"""
+        if not self._db_opened:
+            self._db_opened = True
+            if self._db_path:
+                try:
+                    directory = os.path.dirname(self._db_path)
+                    if directory:
+                        os.makedirs(directory, exist_ok=True)
+                    self._db = sqlite3.connect(self._db_path, check_same_thread=False)
+                    self._db.execute('PRAGMA journal_mode=WAL')
+                    self._db.execute(
+                        'CREATE TABLE IF NOT EXISTS geocoding ('
+                        'key TEXT PRIMARY KEY, value TEXT, expires_at REAL, accessed_at REAL)'
+                    )
+                    self._db.execute('CREATE INDEX IF NOT EXISTS geocoding_accessed ON geocoding (accessed_at)')
+                    self._db.commit()
+                except (OSError, sqlite3.Error) as e:
+                    print(f"Cache de géocodage sur disque indisponible ({self._db_path}): {e}")
+                    self._db = None
+        return self._db
+
+    def get(self, key):
+        """Retourne (trouvé, valeur) ; valeur vaut None pour un échec mis en cache"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and entry[1] <= now:
+                del self._memory[key]
+                self.expirations += 1
+                entry = None
+            if entry is None and self._connection() is not None:
+                entry = self._load_from_disk(key, now)
+                if entry is not None:
+                    self._remember(key, entry)
+            if entry is None:
+                self.misses += 1
+                return False, None
+            self._memory.move_to_end(key)
+            if entry[0] is None:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+            return True, entry[0]
+
+    def set(self, key, value):
+        """Met en cache un résultat de géocodage"""
+        self._store(key, value, self.ttl)
+
+    def set_failure(self, key):
+        """Met en cache un échec de géocodage pour une courte durée"""
+        self._store(key, None, self.negative_ttl)
+
+    def _store(self, key, value, ttl):
+        now = time.time()
+        entry = (value, now + ttl)
+        with self._lock:
+            self._remember(key, entry)
+            if self._connection() is not None:
+                try:
+                    self._db.execute(
+                        'INSERT OR REPLACE INTO geocoding (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)',
+                        (key, json.dumps(value), entry[1], now)
+                    )
+                    self._disk_writes += 1
+                    self._flush_access()
+                    if self._disk_writes % 1000 == 0:
+                        self._prune_disk(now)
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    print(f"Erreur d'écriture du cache de géocodage: {e}")
+
+    def _remember(self, key, entry):
+        """Ajoute une entrée au LRU mémoire (verrou déjà acquis)"""
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def _load_from_disk(self, key, now):
+        try:
+            row = self._db.execute(
+                'SELECT value, expires_at FROM geocoding WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] <= now:
+                self._db.execute('DELETE FROM geocoding WHERE key = ?', (key,))
+                self._db.commit()
+                self.expirations += 1
+                return None
+            # Date d'accès (pour l'éviction LRU) écrite par lots, pas à chaque lecture
+            self._pending_access[key] = now
+            if len(self._pending_access) >= self.access_batch:
+                self._flush_access()
+                self._db.commit()
+            return (json.loads(row[0]), row[1])
+        except sqlite3.Error as e:
+            print(f"Erreur de lecture du cache de géocodage: {e}")
+            return None
+
+    def _flush_access(self):
+        """Écrit les dates d'accès en attente (verrou déjà acquis, sans commit)"""
+        if self._pending_access:
+            self._db.executemany('UPDATE geocoding SET accessed_at = ? WHERE key = ?',
+                                 [(accessed_at, key) for key, accessed_at in self._pending_access.items()])
+            self._pending_access.clear()
+
+    def _prune_disk(self, now):
+        """Supprime les entrées expirées puis les moins récemment utilisées au-delà de la limite"""
+        cursor = self._db.execute('DELETE FROM geocoding WHERE expires_at <= ?', (now,))
+        self.expirations += max(cursor.rowcount, 0)
+        count = self._db.execute('SELECT COUNT(*) FROM geocoding').fetchone()[0]
+        excess = count - self.max_disk_entries
+        if self.max_disk_entries > 0 and excess > 0:
+            self._db.execute(
+                'DELETE FROM geocoding WHERE key IN '
+                '(SELECT key FROM geocoding ORDER BY accessed_at LIMIT ?)', (excess,)
+            )
+            self.evictions += excess
+
+    def stats(self):
+        """Retourne les compteurs du cache"""
+        with self._lock:
+            disk_entries = None
+            if self._connection() is not None:
+                try:
+                    disk_entries = self._db.execute('SELECT COUNT(*) FROM geocoding').fetchone()[0]
+                except sqlite3.Error:
+                    pass
+            return {
+                'memory_entries': len(self._memory),
+                'disk_entries': disk_entries,
+                'hits': self.hits,
+                'negative_hits': self.negative_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
+
+class TokenBucket:
+    """Seau à jetons pour limiter le débit de requêtes vers un fournisseur"""
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self):
+        """Prend un jeton sans attendre ; retourne False si le seau est vide"""
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+    def wait_time(self):
+        """Temps (s) avant qu'un jeton soit disponible"""
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1 or self.rate <= 0:
+                return 0.0 if self._tokens >= 1 else float('inf')
+            return (1 - self._tokens) / self.rate
+
+class GeocodingUnavailable(Exception):
+    """Aucun fournisseur de géocodage n'a pu être interrogé (limites de débit ou pause)"""
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after  # délai (s) avant le prochain jeton, si connu
+
+class GeocodingClient:
+    """Client de géocodage inverse : connexions réutilisées, limite de débit par fournisseur,
+    requêtes concurrentes décalées (le premier bon résultat l'emporte) et pause sans blocage
+    des fournisseurs en échec"""
+    def __init__(self, providers, timeout=3, hedge_delay_ms=300, max_workers=16,
+                 backoff_base=1.0, backoff_max=60.0, metrics=None):
+        self.timeout = timeout
+        self.metrics = metrics
+        self.hedge_delay = hedge_delay_ms / 1000.0
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(providers), pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({
             'User-Agent': 'PLONK-Geolocation-Tool/1.0',
             'Accept': 'application/json'
+        })
+        self.providers = OrderedDict()
+        for provider in providers:
+            self.providers[provider['name']] = {
+                'url': provider['url'].rstrip('/'),
+                'bucket': TokenBucket(provider['rate']),
+                'failures': 0,
+                'cooldown_until': 0.0,
+                'stats': {'requests': 0, 'successes': 0, 'failures': 0, 'retries': 0, 'throttled': 0,
+                          'cooldown_skips': 0}
+            }
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='geocoding')
+
+    def query(self, name, lat, lon):
+        """Interroge un fournisseur ; retourne le résultat brut normalisé ou None"""
+        provider = self.providers[name]
+        if name == 'nominatim':
+            url = f"{provider['url']}/reverse"
+            params = {'format': 'json', 'lat': lat, 'lon': lon, 'zoom': 16, 'addressdetails': 1}
+            parse = self.parse_nominatim
+        else:
+            url = f"{provider['url']}/reverse"
+            params = {'lat': lat, 'lon': lon}
+            parse = self.parse_photon
+
+        with self._lock:
+            provider['stats']['requests'] += 1
+        try:
+            with MetricTimer(self.metrics, 'plonk_geocode_request_seconds', {'provider': name}):
+                response = self.session.get(url, params=params, timeout=self.timeout)
+        except requests.RequestException as e:
+            self._record_failure(name)
+            print(f"Erreur avec {name}: {e}")
+            return None
+
+        if response.status_code != 200:
+            self._record_failure(name, response.headers.get('Retry-After'))
+            return None
+        try:
+            result = parse(response.json())
+        except ValueError:
+            self._record_failure(name)
+            return None
+        with self._lock:
+            provider['failures'] = 0
+            provider['stats']['successes'] += 1
+        return result
+
+    def _record_failure(self, name, retry_after=None):
+        """Met le fournisseur en pause (backoff exponentiel) au lieu de bloquer le thread"""
+        provider = self.providers[name]
+        with self._lock:
+            provider['failures'] += 1
+            provider['stats']['failures'] += 1
+            delay = min(self.backoff_base * 2 ** (provider['failures'] - 1), self.backoff_max)
+            try:
+                if retry_after is not None:
+                    delay = max(delay, float(retry_after))
+            except ValueError:
+                pass
+            provider['cooldown_until'] = time.monotonic() + delay
+
+    def _in_cooldown(self, name):
+        with self._lock:
+            provider = self.providers[name]
+            if provider['cooldown_until'] > time.monotonic():
+                provider['stats']['cooldown_skips'] += 1
+                return True
+            return False
+
+    def reverse(self, lat, lon, accept=None):
+        """Géocodage inverse : retourne le premier résultat accepté, ou None
+
+        Le fournisseur suivant n'est lancé que si le précédent n'a pas répondu
+        dans le délai de couverture (hedge_delay_ms). Lève GeocodingUnavailable
+        si aucun fournisseur n'a pu être interrogé.
+        """
+        accept = accept or (lambda result: result is not None)
+        names = [name for name in self.providers if not self._in_cooldown(name)]
+        pending = set()
+        launched = []
+
+        def launch(name):
+            # Toute requête après la première (couverture ou nouvel essai) compte comme une relance
+            if launched:
+                with self._lock:
+                    self.providers[name]['stats']['retries'] += 1
+            launched.append(name)
+            pending.add(self._executor.submit(self.query, name, lat, lon))
+
+        def collect(timeout):
+            nonlocal pending
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                if accept(result):
+                    return result
+            return None
+
+        throttled = []
+        for name in names:
+            if not self.providers[name]['bucket'].try_acquire():
+                with self._lock:
+                    self.providers[name]['stats']['throttled'] += 1
+                throttled.append(name)
+                continue
+            launch(name)
+            result = collect(self.hedge_delay)
+            if result is not None:
+                return result
+
+        while pending:
+            result = collect(None)
+            if result is not None:
+                return result
+
+        # Fournisseurs limités : ne pas attendre de jeton, l'appelant réessaiera plus tard
+        if throttled:
+            retry_after = min(self.providers[n]['bucket'].wait_time() for n in throttled)
+            raise GeocodingUnavailable(f"Aucun fournisseur disponible pour {lat}, {lon}",
+                                       retry_after=retry_after)
+
+        if not names:
+            with self._lock:
+                retry_after = min(provider['cooldown_until'] for provider in self.providers.values()) - time.monotonic()
+            raise GeocodingUnavailable(f"Tous les fournisseurs sont en pause pour {lat}, {lon}",
+                                       retry_after=max(0.0, retry_after))
+        return None
+
+    @staticmethod
+    def parse_nominatim(data):
+        address = data.get('address', {})
+        return {
+            'full_address': data.get('display_name', ''),
+            'city': address.get('city') or address.get('town') or address.get('village') or address.get('municipality', ''),
+            'country': address.get('country', ''),
+            'state': address.get('state', ''),
+            'road': address.get('road', ''),
+            'house_number': address.get('house_number', ''),
+            'postcode': address.get('postcode', ''),
+            'suburb': address.get('suburb', ''),
+            'county': address.get('county', '')
+        }
+
+    @staticmethod
+    def parse_photon(data):
+        if not data.get('features'):
+            return None
+        props = data['features'][0].get('properties', {})
+        return {
+            'full_address': props.get('name', ''),
+            'city': props.get('city') or props.get('town') or props.get('village', ''),
+            'country': props.get('country', ''),
+            'state': props.get('state', ''),
+            'road': props.get('street', ''),
+            'house_number': props.get('housenumber', ''),
+            'postcode': props.get('postcode', ''),
+            'suburb': props.get('suburb', ''),
+            'county': props.get('county', '')
         }
-        response = requests.get(url, headers=headers, timeout=3)
-        if response.status_code == 200:
-            data = response.json()
-            address = data.get('address', {})
+
+    def stats(self):
+        with self._lock:
+            return {name: dict(provider['stats'], in_cooldown=provider['cooldown_until'] > time.monotonic())
+                    for name, provider in self.providers.items()}
+
+class RequestCoalescer:
+    """Fusionne les requêtes concurrentes portant sur la même clé en une seule exécution"""
+    def __init__(self, max_workers=16):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='coalescer')
+        self._in_flight = {}  # key -> Future partagé
+        self._lock = threading.Lock()
+        self.executions = 0
+        self.coalesced = 0
+
+    def submit(self, key, fn, *args):
+        """Retourne le Future en cours pour cette clé, ou lance fn(*args)"""
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future
+            future = Future()
+            self._in_flight[key] = future
+            self.executions += 1
+
+        def run():
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                with self._lock:
+                    self._in_flight.pop(key, None)
+
+        self._executor.submit(run)
+        return future
+
+    def stats(self):
+        with self._lock:
             return {
-                'full_address': data.get('display_name', ''),
-                'city': address.get('city') or address.get('town') or address.get('village') or address.get('municipality', ''),
-                'country': address.get('country', ''),
-                'state': address.get('state', ''),
-                'road': address.get('road', ''),
-                'house_number': address.get('house_number', ''),
-                'postcode': address.get('postcode', ''),
-                'suburb': address.get('suburb', ''),
-                'county': address.get('county', '')
+                'in_flight': len(self._in_flight),
+                'executions': self.executions,
+                'coalesced': self.coalesced
             }
-    except:
-        pass
-    return None
 
-def try_photon(lat, lon):
-    """Essaie le géocodage avec Photon (Komoot)"""
-    try:
-        url = f"https://photon.komoot.io/reverse?lat={lat}&lon={lon}"
-        response = requests.get(url, timeout=3)
-        if response.status_code == 200:
-            data = response.json()
-            if data.get('features'):
-                props = data['features'][0].get('properties', {})
-                return {
-                    'full_address': props.get('name', ''),
-                    'city': props.get('city') or props.get('town') or props.get('village', ''),
-                    'country': props.get('country', ''),
-                    'state': props.get('state', ''),
-                    'road': props.get('street', ''),
-                    'house_number': props.get('housenumber', ''),
-                    'postcode': props.get('postcode', ''),
-                    'suburb': props.get('suburb', ''),
-                    'county': props.get('county', '')
-                }
-    except:
-        pass
-    return None
+class KDTree3:
+    """Arbre k-d compact (tableaux NumPy) pour la recherche du plus proche voisin en 3D"""
+    def __init__(self, points, leaf_size=32):
+        self.points = np.ascontiguousarray(points, dtype=np.float64)
+        self.index = np.arange(self.points.shape[0])
+        split_dim, split_value, left, right, start, end = [], [], [], [], [], []
 
-def get_location_info_detailed(lat, lon, retry_count=0):
-    """Récupère les informations de localisation avec plusieurs APIs et gestion des erreurs améliorée"""
-    # Vérifier le cache d'abord
-    cache_key = get_cache_key(lat, lon)
-    if cache_key in config.geocoding_cache:
-        return config.geocoding_cache[cache_key]
-    
-    # Délai progressif pour éviter les limitations d'API
-    if retry_count > 0:
-        delay = min(retry_count * 0.5, 3.0)  # Délai progressif jusqu'à 3 secondes max
-        time.sleep(delay)
-    
-    # Essayer plusieurs APIs dans l'ordre de préférence avec rotation
-    apis = [try_photon, try_nominatim]
-    
-    # Rotation des APIs selon le retry_count pour éviter de surcharger une seule API
-    start_index = retry_count % len(apis)
-    rotated_apis = apis[start_index:] + apis[:start_index]
-    
-    for api_func in rotated_apis:
-        try:
-            result = api_func(lat, lon)
-            if result and (result['city'] or result['country']):
-                # Vérifier que les résultats ne sont pas vides ou "inconnu"
-                city = result['city']
-                country = result['country']
-                
-                # Filtrer les résultats de mauvaise qualité
-                if city and city.lower() not in ['unknown', 'inconnu', 'ville inconnue', '']:
-                    if country and country.lower() not in ['unknown', 'inconnu', 'pays inconnu', '']:
-                        cleaned_result = {
-                            'full_address': result['full_address'] or f"Lat: {lat:.6f}, Lon: {lon:.6f}",
-                            'city': city,
-                            'country': country,
-                            'state': result['state'] or '',
-                            'road': result['road'] or '',
-                            'house_number': result['house_number'] or '',
-                            'postcode': result['postcode'] or '',
-                            'suburb': result['suburb'] or '',
-                            'county': result['county'] or ''
-                        }
-                        
-                        # Mettre en cache
-                        config.geocoding_cache[cache_key] = cleaned_result
-                        return cleaned_result
-        except Exception as e:
-            print(f"Erreur avec {api_func.__name__}: {e}")
-            continue
-    
-    # Si toutes les APIs ont échoué et qu'on n'a pas encore fait de retry
-    if retry_count < 2:  # Maximum 2 retries
-        print(f"Retry {retry_count + 1} pour {lat}, {lon}")
-        return get_location_info_detailed(lat, lon, retry_count + 1)
-    
-    # Valeur par défaut si toutes les APIs échouent après retries
-    default_info = {
+        def new_node(lo, hi):
+            split_dim.append(-1)
+            split_value.append(0.0)
+            left.append(-1)
+            right.append(-1)
+            start.append(lo)
+            end.append(hi)
+            return len(start) - 1
+
+        stack = [new_node(0, self.points.shape[0])] if self.points.shape[0] else []
+        while stack:
+            node = stack.pop()
+            lo, hi = start[node], end[node]
+            if hi - lo <= leaf_size:
+                continue
+            subset = self.index[lo:hi]
+            coords = self.points[subset]
+            dim = int(np.argmax(coords.max(axis=0) - coords.min(axis=0)))
+            mid = (hi - lo) // 2
+            order = np.argpartition(coords[:, dim], mid)
+            self.index[lo:hi] = subset[order]
+            split_dim[node] = dim
+            split_value[node] = float(self.points[self.index[lo + mid], dim])
+            left[node] = new_node(lo, lo + mid)
+            right[node] = new_node(lo + mid, hi)
+            stack.extend([left[node], right[node]])
+
+        self.split_dim = np.array(split_dim, dtype=np.int8)
+        self.split_value = np.array(split_value)
+        self.left = np.array(left, dtype=np.int64)
+        self.right = np.array(right, dtype=np.int64)
+        self.start = np.array(start, dtype=np.int64)
+        self.end = np.array(end, dtype=np.int64)
+
+        # Membres de chaque feuille dans une matrice complétée par -1, pour les requêtes groupées
+        leaves = np.flatnonzero(self.split_dim < 0)
+        self.leaf_row = np.full(len(start), -1, dtype=np.int64)
+        self.leaf_row[leaves] = np.arange(len(leaves))
+        self.leaf_members = np.full((len(leaves), max(1, leaf_size)), -1, dtype=np.int64)
+        for row, node in enumerate(leaves):
+            members = self.index[self.start[node]:self.end[node]]
+            self.leaf_members[row, :len(members)] = members
+
+    def query(self, q):
+        """Retourne (indice du point le plus proche, distance euclidienne au carré)"""
+        best_index, best_d2 = -1, float('inf')
+        if self.points.shape[0] == 0:
+            return best_index, best_d2
+        split_dim, split_value = self.split_dim, self.split_value
+        stack = [(0, 0.0)]
+        while stack:
+            node, bound = stack.pop()
+            if bound >= best_d2:
+                continue
+            dim = split_dim[node]
+            if dim < 0:
+                candidates = self.index[self.start[node]:self.end[node]]
+                d2 = ((self.points[candidates] - q) ** 2).sum(axis=1)
+                i = int(np.argmin(d2))
+                if d2[i] < best_d2:
+                    best_index, best_d2 = int(candidates[i]), float(d2[i])
+                continue
+            diff = q[dim] - split_value[node]
+            near, far = (self.left[node], self.right[node]) if diff < 0 else (self.right[node], self.left[node])
+            stack.append((far, diff * diff))
+            stack.append((near, 0.0))
+        return best_index, best_d2
+
+    def _scan_leaves(self, queries, query_ids, nodes, best_index, best_d2):
+        """Distances de chaque requête aux points de sa feuille, en une seule opération NumPy"""
+        members = self.leaf_members[self.leaf_row[nodes]]
+        valid = members >= 0
+        d2 = ((self.points[np.where(valid, members, 0)] - queries[query_ids][:, None, :]) ** 2).sum(axis=2)
+        d2[~valid] = np.inf
+        column = np.argmin(d2, axis=1)
+        rows = np.arange(len(nodes))
+        candidate_d2 = d2[rows, column]
+        candidate_index = members[rows, column]
+        # Meilleur candidat par requête (une requête peut visiter plusieurs feuilles)
+        order = np.lexsort((candidate_d2, query_ids))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = query_ids[order][1:] != query_ids[order][:-1]
+        chosen = order[first]
+        ids = query_ids[chosen]
+        better = candidate_d2[chosen] < best_d2[ids]
+        best_d2[ids[better]] = candidate_d2[chosen][better]
+        best_index[ids[better]] = candidate_index[chosen][better]
+
+    def query_many(self, queries, chunk_size=4096):
+        """Plus proches voisins de plusieurs points : parcours de l'arbre en largeur, par lots"""
+        queries = np.ascontiguousarray(queries, dtype=np.float64).reshape(-1, 3)
+        best_index = np.full(len(queries), -1, dtype=np.int64)
+        best_d2 = np.full(len(queries), np.inf)
+        if self.points.shape[0] == 0 or len(queries) == 0:
+            return best_index, best_d2
+        for lo in range(0, len(queries), chunk_size):
+            block = queries[lo:lo + chunk_size]
+            block_index = best_index[lo:lo + chunk_size]
+            block_d2 = best_d2[lo:lo + chunk_size]
+            ids = np.arange(len(block))
+
+            # Descente directe vers la feuille de chaque point : première borne supérieure
+            nodes = np.zeros(len(block), dtype=np.int64)
+            internal = self.split_dim[nodes] >= 0
+            while internal.any():
+                current = nodes[internal]
+                go_left = block[ids[internal], self.split_dim[current]] < self.split_value[current]
+                nodes[internal] = np.where(go_left, self.left[current], self.right[current])
+                internal = self.split_dim[nodes] >= 0
+            self._scan_leaves(block, ids, nodes, block_index, block_d2)
+
+            # Parcours exact : seules les branches plus proches que la borne actuelle sont visitées
+            nodes = np.zeros(len(block), dtype=np.int64)
+            bounds = np.zeros(len(block))
+            while len(ids):
+                keep = bounds < block_d2[ids]
+                ids, nodes, bounds = ids[keep], nodes[keep], bounds[keep]
+                dims = self.split_dim[nodes]
+                leaf = dims < 0
+                if leaf.any():
+                    self._scan_leaves(block, ids[leaf], nodes[leaf], block_index, block_d2)
+                ids, nodes, bounds, dims = ids[~leaf], nodes[~leaf], bounds[~leaf], dims[~leaf]
+                diff = block[ids, dims] - self.split_value[nodes]
+                near = np.where(diff < 0, self.left[nodes], self.right[nodes])
+                far = np.where(diff < 0, self.right[nodes], self.left[nodes])
+                ids = np.concatenate([ids, ids])
+                nodes = np.concatenate([near, far])
+                bounds = np.concatenate([bounds, np.maximum(bounds, diff * diff)])
+        return best_index, best_d2
+
+def lat_lon_to_unit(lat, lon):
+    """Convertit des latitudes/longitudes (degrés) en vecteurs unitaires 3D"""
+    lat_rad = np.radians(np.asarray(lat, dtype=float))
+    lon_rad = np.radians(np.asarray(lon, dtype=float))
+    cos_lat = np.cos(lat_rad)
+    return np.stack([cos_lat * np.cos(lon_rad), cos_lat * np.sin(lon_rad), np.sin(lat_rad)], axis=-1)
+
+class OfflineGeocoder:
+    """Géocodeur inverse hors ligne à partir d'un fichier de villes GeoNames (cities500.txt, ...)
+
+    Optionnel : countryInfo.txt et admin1CodesASCII.txt pour les noms de pays et de
+    régions, et un GeoJSON de polygones de pays pour corriger le pays près des frontières.
+    """
+    def __init__(self, cities_path, countries_path=None, admin1_path=None, polygons_path=None, max_distance_km=50):
+        self.max_distance_km = max_distance_km
+        self.country_names = self._read_country_names(countries_path) if countries_path else {}
+        self.admin1_names = self._read_admin1_names(admin1_path) if admin1_path else {}
+
+        names, country_codes, admin1_codes, lats, lons = [], [], [], [], []
+        with open(cities_path, encoding='utf-8') as f:
+            for line in f:
+                columns = line.rstrip('\n').split('\t')
+                if len(columns) < 11:
+                    continue
+                names.append(columns[1])
+                lats.append(float(columns[4]))
+                lons.append(float(columns[5]))
+                country_codes.append(columns[8])
+                admin1_codes.append(columns[10])
+        if not names:
+            raise ValueError(f"Aucune ville lue dans {cities_path}")
+
+        self.names = names
+        self.country_codes = country_codes
+        self.admin1_codes = admin1_codes
+        self.lats = np.array(lats, dtype=np.float32)
+        self.lons = np.array(lons, dtype=np.float32)
+        self.tree = KDTree3(lat_lon_to_unit(self.lats, self.lons))
+        self.country_array = np.array(country_codes)
+        self._country_trees = {}
+        self.polygons = self._read_polygons(polygons_path) if polygons_path else []
+        print(f"Géocodeur hors ligne : {len(names)} villes, {len(self.polygons)} polygones de pays")
+
+    @staticmethod
+    def _read_country_names(path):
+        names = {}
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.startswith('#'):
+                    continue
+                columns = line.rstrip('\n').split('\t')
+                if len(columns) > 4:
+                    names[columns[0]] = columns[4]
+        return names
+
+    @staticmethod
+    def _read_admin1_names(path):
+        names = {}
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                columns = line.rstrip('\n').split('\t')
+                if len(columns) > 1:
+                    names[columns[0]] = columns[1]
+        return names
+
+    @staticmethod
+    def _read_polygons(path):
+        """Lit un GeoJSON de pays : liste de (nom, code, bbox, anneaux)"""
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        polygons = []
+        for feature in data.get('features', []):
+            props = feature.get('properties') or {}
+            geometry = feature.get('geometry') or {}
+            name = props.get('ADMIN') or props.get('NAME') or props.get('name') or ''
+            code = props.get('ISO_A2') or props.get('iso_a2') or ''
+            if geometry.get('type') == 'Polygon':
+                parts = [geometry['coordinates']]
+            elif geometry.get('type') == 'MultiPolygon':
+                parts = geometry['coordinates']
+            else:
+                continue
+            for part in parts:
+                rings = [np.asarray(ring, dtype=np.float64)[:, :2] for ring in part if len(ring) >= 3]
+                if not rings:
+                    continue
+                outer = rings[0]
+                bbox = (outer[:, 0].min(), outer[:, 1].min(), outer[:, 0].max(), outer[:, 1].max())
+                polygons.append((name, code, bbox, rings))
+        return polygons
+
+    def _country_at(self, lat, lon):
+        """Pays contenant le point (lancer de rayon, trous compris), ou None"""
+        for name, code, (min_lon, min_lat, max_lon, max_lat), rings in self.polygons:
+            if not (min_lon <= lon <= max_lon and min_lat <= lat <= max_lat):
+                continue
+            inside = False
+            for ring in rings:
+                x, y = ring[:, 0], ring[:, 1]
+                x_next, y_next = np.roll(x, -1), np.roll(y, -1)
+                crosses = (y > lat) != (y_next > lat)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    x_cross = x + (lat - y) * (x_next - x) / (y_next - y)
+                if np.count_nonzero(crosses & (lon < x_cross)) % 2 == 1:
+                    inside = not inside
+            if inside:
+                return name, code
+        return None
+
+    def _country_tree(self, country_code):
+        """Arbre des villes d'un seul pays (construit au premier usage)"""
+        if country_code not in self._country_trees:
+            members = np.flatnonzero(self.country_array == country_code)
+            tree = KDTree3(lat_lon_to_unit(self.lats[members], self.lons[members])) if len(members) else None
+            self._country_trees[country_code] = (members, tree)
+        return self._country_trees[country_code]
+
+    def _nearest_in_country(self, country_code, lat, lon):
+        """Ville la plus proche dans un pays donné : (indice, distance au carré) ou (-1, inf)"""
+        members, tree = self._country_tree(country_code)
+        if tree is None:
+            return -1, float('inf')
+        index, d2 = tree.query(lat_lon_to_unit(lat, lon))
+        return (int(members[index]), d2) if index >= 0 else (-1, d2)
+
+    def _chord_to_km(self, d2):
+        return 2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(1.0, np.sqrt(d2) / 2))
+
+    def _describe(self, index, d2, lat, lon):
+        """Construit le résultat pour la ville trouvée, en corrigeant le pays près des frontières
+
+        Si aucune ville n'est à moins de max_distance_km mais que le point est dans un pays
+        connu, retourne ce pays seul (ville vide) ; None si le point n'est dans aucun pays.
+        """
+        found = self._country_at(lat, lon) if self.polygons else None
+        if found and (index < 0 or self._chord_to_km(d2) > self.max_distance_km
+                      or found[1] != self.country_codes[index]):
+            # Ville trop loin, ou de l'autre côté d'une frontière :
+            # chercher la ville la plus proche dans le pays qui contient le point
+            index, d2 = self._nearest_in_country(found[1], lat, lon)
+            if index < 0 or self._chord_to_km(d2) > self.max_distance_km:
+                country = found[0] or self.country_names.get(found[1], found[1])
+                return self._format('', country, '')
+        elif index < 0 or self._chord_to_km(d2) > self.max_distance_km:
+            return None
+
+        city = self.names[index]
+        country_code = self.country_codes[index]
+        country = self.country_names.get(country_code, country_code)
+        state = self.admin1_names.get(f"{country_code}.{self.admin1_codes[index]}", '')
+        return self._format(city, country, state)
+
+    @staticmethod
+    def _format(city, country, state):
+        return {
+            'full_address': ', '.join(part for part in (city, state, country) if part),
+            'city': city,
+            'country': country,
+            'state': state,
+            'road': '',
+            'house_number': '',
+            'postcode': '',
+            'suburb': '',
+            'county': ''
+        }
+
+    def lookup(self, lat, lon):
+        """Ville la plus proche au format de get_location_info_detailed, ou None"""
+        index, d2 = self.tree.query(lat_lon_to_unit(lat, lon))
+        return self._describe(index, d2, lat, lon)
+
+    def lookup_many(self, lats, lons):
+        """Recherche groupée pour plusieurs points (distances aux feuilles calculées par lots)"""
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        indices, d2 = self.tree.query_many(lat_lon_to_unit(lats, lons))
+        return [self._describe(int(index), float(dist), float(lat), float(lon))
+                for index, dist, lat, lon in zip(indices, d2, lats, lons)]
+
+class PredictionCache:
+    """Cache LRU des échantillons bruts de PLONK, indexé par (hash de l'image, modèle, réglages d'inférence)
+
+    Un tirage plus grand déjà en cache sert aussi les demandes plus petites.
+    """
+    def __init__(self, max_memory_mb=256, cache_dir=None, max_disk_mb=2048):
+        self.max_memory_bytes = max_memory_mb * 1024 * 1024
+        self.max_disk_bytes = max_disk_mb * 1024 * 1024
+        self.cache_dir = cache_dir
+        self._memory = OrderedDict()  # key -> np.ndarray (n, 2)
+        self._memory_bytes = 0
+        self._disk = OrderedDict()  # key -> (chemin, taille)
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            entries = []
+            for filename in os.listdir(cache_dir):
+                if filename.endswith('.npy'):
+                    path = os.path.join(cache_dir, filename)
+                    entries.append((os.path.getmtime(path), filename[:-4], path, os.path.getsize(path)))
+            for _, key, path, size in sorted(entries):
+                self._disk[key] = (path, size)
+                self._disk_bytes += size
+
+    @staticmethod
+    def make_key(image_hash, model_id, sampling_params=()):
+        raw = json.dumps([image_hash, model_id, list(sampling_params)])
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, image_hash, model_id, num_samples, sampling_params=()):
+        """Retourne au moins num_samples échantillons en cache, ou None"""
+        key = self.make_key(image_hash, model_id, sampling_params)
+        with self._lock:
+            samples = self._memory.get(key)
+            if samples is not None:
+                self._memory.move_to_end(key)
+            elif key in self._disk:
+                path, _ = self._disk[key]
+                try:
+                    samples = np.asarray(np.load(path), dtype=np.float64)
+                    os.utime(path)
+                    self._disk.move_to_end(key)
+                    self._remember(key, samples)
+                except (OSError, ValueError):
+                    self._drop_disk(key)
+                    samples = None
+            if samples is None or samples.shape[0] < num_samples:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return samples[:num_samples]
+
+    def put(self, image_hash, model_id, samples, sampling_params=()):
+        """Conserve les échantillons (le plus grand tirage pour une même clé)"""
+        key = self.make_key(image_hash, model_id, sampling_params)
+        samples = np.array(samples, dtype=np.float64).reshape(-1, 2)
+        with self._lock:
+            existing = self._memory.get(key)
+            if existing is not None and existing.shape[0] >= samples.shape[0]:
+                return
+            self._remember(key, samples)
+            if self.cache_dir:
+                path = os.path.join(self.cache_dir, key + '.npy')
+                try:
+                    np.save(path, samples)
+                    self._drop_disk(key, remove_file=False)
+                    size = os.path.getsize(path)
+                    self._disk[key] = (path, size)
+                    self._disk_bytes += size
+                    while self._disk_bytes > self.max_disk_bytes and len(self._disk) > 1:
+                        self._drop_disk(next(iter(self._disk)))
+                        self.evictions += 1
+                except OSError as e:
+                    print(f"Erreur d'écriture du cache de prédictions: {e}")
+
+    def _remember(self, key, samples):
+        """Ajoute au LRU mémoire (verrou déjà acquis)"""
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_bytes -= previous.nbytes
+        self._memory[key] = samples
+        self._memory_bytes += samples.nbytes
+        while self._memory_bytes > self.max_memory_bytes and len(self._memory) > 1:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= evicted.nbytes
+            self.evictions += 1
+
+    def _drop_disk(self, key, remove_file=True):
+        entry = self._disk.pop(key, None)
+        if entry is None:
+            return
+        self._disk_bytes -= entry[1]
+        if remove_file:
+            try:
+                os.remove(entry[0])
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                'memory_entries': len(self._memory),
+                'memory_mb': round(self._memory_bytes / (1024 * 1024), 2),
+                'disk_entries': len(self._disk),
+                'disk_mb': round(self._disk_bytes / (1024 * 1024), 2),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+class QueueFull(Exception):
+    """La file d'attente des analyses est pleine"""
+    def __init__(self, retry_after):
+        super().__init__("File d'attente pleine, réessayez plus tard")
+        self.retry_after = retry_after
+
+class AnalysisWorkerPool:
+    """Pool de workers pour les analyses, avec file d'attente bornée et voies prioritaires
+
+    La voie 'quick' (analyses en une passe) est servie en priorité ; un worker lui est
+    réservé et la voie 'heavy' reçoit au moins un job sur `heavy_share` pour ne pas être affamée.
+    """
+    LANES = ('quick', 'heavy')
+
+    def __init__(self, num_workers=2, max_queue=32, reserved_quick_workers=1, heavy_share=4):
+        self.num_workers = max(1, num_workers)
+        self.max_queue = max(1, max_queue)
+        self.reserved_quick_workers = min(reserved_quick_workers, self.num_workers - 1)
+        self.heavy_share = max(1, heavy_share)
+        self._lanes = OrderedDict((lane, deque()) for lane in self.LANES)
+        self._cond = threading.Condition()
+        self._quick_streak = 0
+        self._avg_duration = {lane: 5.0 for lane in self.LANES}  # Moyenne glissante (s)
+        self.active = 0
+        self.completed = 0
+        self.rejected = 0
+        for i in range(self.num_workers):
+            threading.Thread(target=self._run, args=(i < self.reserved_quick_workers,),
+                             name=f'analysis-worker-{i}', daemon=True).start()
+
+    def submit(self, job_id, fn, lane='quick'):
+        """Met un job en file ; lève QueueFull si la file est pleine"""
+        with self._cond:
+            if self.queue_depth() >= self.max_queue:
+                self.rejected += 1
+                raise QueueFull(self.retry_after())
+            self._lanes[lane].append((job_id, fn))
+            self._cond.notify_all()
+
+    def ensure_capacity(self):
+        """Lève QueueFull si la file est pleine (avant de décoder l'image)"""
+        with self._cond:
+            if self.queue_depth() >= self.max_queue:
+                self.rejected += 1
+                raise QueueFull(self.retry_after())
+
+    def queue_depth(self):
+        return sum(len(queue) for queue in self._lanes.values())
+
+    def position(self, job_id):
+        """Position (1 = prochain) d'un job en attente, ou None s'il n'est plus en file"""
+        with self._cond:
+            ahead = 0
+            for lane, queue in self._lanes.items():
+                for i, (queued_id, _) in enumerate(queue):
+                    if queued_id == job_id:
+                        # Les jobs rapides passent devant les jobs lourds
+                        return ahead + i + 1 if lane == 'heavy' else i + 1
+                ahead += len(queue)
+        return None
+
+    def retry_after(self):
+        """Estimation (s) du temps avant qu'une place se libère"""
+        backlog = sum(len(queue) * self._avg_duration[lane] for lane, queue in self._lanes.items())
+        return max(1, int(math.ceil(backlog / self.num_workers)))
+
+    def _next_job(self, quick_only):
+        with self._cond:
+            while True:
+                quick, heavy = self._lanes['quick'], self._lanes['heavy']
+                if quick and (quick_only or not heavy or self._quick_streak < self.heavy_share - 1):
+                    self._quick_streak += 1
+                    lane = 'quick'
+                elif heavy and not quick_only:
+                    self._quick_streak = 0
+                    lane = 'heavy'
+                else:
+                    self._cond.wait()
+                    continue
+                job_id, fn = self._lanes[lane].popleft()
+                self.active += 1
+                return lane, job_id, fn
+
+    def _run(self, quick_only):
+        while True:
+            lane, job_id, fn = self._next_job(quick_only)
+            start = time.monotonic()
+            try:
+                fn(job_id)
+            except Exception as e:
+                print(f"Erreur du worker pour {job_id}: {e}")
+            finally:
+                duration = time.monotonic() - start
+                with self._cond:
+                    self.active -= 1
+                    self.completed += 1
+                    self._avg_duration[lane] = 0.8 * self._avg_duration[lane] + 0.2 * duration
+
+    def stats(self):
+        with self._cond:
+            return {
+                'workers': self.num_workers,
+                'active': self.active,
+                'queued': {lane: len(queue) for lane, queue in self._lanes.items()},
+                'max_queue': self.max_queue,
+                'completed': self.completed,
+                'rejected': self.rejected
+            }
+
+def json_default(value):
+    """Sérialise les scalaires et tableaux NumPy pour json.dumps"""
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"Type non sérialisable: {type(value).__name__}")
+
+class JobStore:
+    """Stockage des analyses : expiration (TTL), plafonds mémoire, mises à jour thread-safe
+    et persistance SQLite optionnelle, partagée entre plusieurs workers gunicorn
+
+    L'état (progrès, résultats) est sérialisable ; les entrées propres au processus
+    (image décodée...) sont gardées à part et ne sont jamais persistées.
+    Avec SQLite, chaque job appartient au processus qui l'a créé ; ce processus publie un
+    battement de cœur (table owners) tant qu'il vit.
+    """
+    FINISHED = ('completed', 'error')
+
+    def __init__(self, ttl=3600, max_jobs=1000, max_memory_mb=128, db_path=None, stale_after=600):
+        self.ttl = ttl
+        self.stale_after = stale_after
+        self.max_jobs = max(1, max_jobs)
+        self.max_memory_bytes = max_memory_mb * 1024 * 1024
+        self._jobs = OrderedDict()  # job_id -> {'state': ..., 'size': ..., 'updated_at': ...}
+        self._inputs = {}  # job_id -> entrées non sérialisables
+        self._memory_bytes = 0
+        self._lock = threading.RLock()
+        self._changed = threading.Condition(self._lock)  # Notifié à chaque écriture
+        self._version = 0
+        self._db = None
+        self.expired = 0
+        self.evicted = 0
+        self.abandoned = 0
+        self._owner_pid = None
+        self._owner_id = None
+        self._heartbeat_thread = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=10)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, state TEXT, status TEXT, updated_at REAL)'
+            )
+            columns = [row[1] for row in self._db.execute('PRAGMA table_info(jobs)')]
+            if 'owner' not in columns:
+                self._db.execute('ALTER TABLE jobs ADD COLUMN owner TEXT')
+            self._db.execute('CREATE TABLE IF NOT EXISTS owners (id TEXT PRIMARY KEY, heartbeat REAL)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS jobs_updated ON jobs (updated_at)')
+            self._db.commit()
+            with self._lock:
+                self._fail_stale(time.time())
+
+    def create(self, state, inputs=None, prefix=''):
+        """Enregistre un nouveau job et retourne son identifiant (UUID4, sans collision)"""
+        job_id = prefix + uuid.uuid4().hex
+        with self._lock:
+            if self._db is not None:
+                self._start_heartbeat()
+            self._prune()
+            self._write(job_id, dict(state))
+            if inputs:
+                self._inputs[job_id] = inputs
+        return job_id
+
+    def get(self, job_id):
+        """Retourne une copie de l'état du job, ou None s'il est inconnu ou expiré"""
+        now = time.time()
+        with self._lock:
+            entry = self._jobs.get(job_id)
+            if entry is not None:
+                if self._is_expired(entry['state'], entry['updated_at'], now):
+                    self._remove(job_id)
+                    self.expired += 1
+                    return None
+                return dict(entry['state'])
+            if self._db is None:
+                return None
+            # Job géré par un autre worker (ou évincé de la mémoire)
+            row = self._db.execute('SELECT state, updated_at FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        state = json.loads(row[0])
+        if self._is_expired(state, row[1], now):
+            return None
+        return state
+
+    def update(self, job_id, **fields):
+        """Met à jour des champs de l'état du job de façon atomique"""
+        with self._lock:
+            entry = self._jobs.get(job_id)
+            state = dict(entry['state']) if entry is not None else self.get(job_id)
+            if state is None:
+                return False
+            state.update(fields)
+            self._write(job_id, state)
+            return True
+
+    def wait_for_update(self, job_id, last_version, timeout=15.0, poll_interval=0.5):
+        """Attend une nouvelle version de l'état du job ; retourne (état, version)
+
+        Les jobs gérés par un autre processus (SQLite) sont relus périodiquement.
+        """
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            if job_id in self._jobs:
+                self._changed.wait_for(
+                    lambda: job_id not in self._jobs or self._jobs[job_id]['version'] != last_version,
+                    timeout=timeout
+                )
+                entry = self._jobs.get(job_id)
+                if entry is not None:
+                    return dict(entry['state']), entry['version']
+        if self._db is None:
+            return None, None
+        while True:
+            with self._lock:
+                row = self._db.execute('SELECT state, updated_at FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            if row is None:
+                return None, None
+            if row[1] != last_version or time.monotonic() >= deadline:
+                return json.loads(row[0]), row[1]
+            time.sleep(poll_interval)
+
+    def pop_input(self, job_id, key, default=None):
+        """Retire et retourne une entrée propre au processus (ex. l'image décodée)"""
+        with self._lock:
+            inputs = self._inputs.get(job_id, {})
+            value = inputs.pop(key, default)
+            if not inputs:
+                self._inputs.pop(job_id, None)
+            return value
+
+    def delete(self, job_id):
+        with self._lock:
+            self._remove(job_id)
+
+    def _is_expired(self, state, updated_at, now):
+        return state.get('status') in self.FINISHED and updated_at + self.ttl < now
+
+    def _write(self, job_id, state):
+        """Écrit l'état en mémoire (et sur disque) ; verrou déjà acquis"""
+        now = time.time()
+        serialized = json.dumps(state, default=json_default)
+        previous = self._jobs.pop(job_id, None)
+        if previous is not None:
+            self._memory_bytes -= previous['size']
+        self._version += 1
+        self._jobs[job_id] = {'state': state, 'size': len(serialized), 'updated_at': now, 'version': self._version}
+        self._memory_bytes += len(serialized)
+        self._changed.notify_all()
+        if self._db is not None:
+            # Le propriétaire est fixé à la création : un autre processus qui met à jour le job ne le reprend pas
+            self._db.execute(
+                'INSERT INTO jobs (id, state, status, updated_at, owner) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT(id) DO UPDATE SET state = excluded.state, status = excluded.status, '
+                'updated_at = excluded.updated_at',
+                (job_id, serialized, state.get('status'), now, self._owner())
+            )
+            self._db.commit()
+        self._enforce_limits()
+
+    def _enforce_limits(self):
+        """Évince de la mémoire les jobs terminés les plus anciens au-delà des plafonds"""
+        while len(self._jobs) > self.max_jobs or self._memory_bytes > self.max_memory_bytes:
+            victim = next((job_id for job_id, entry in self._jobs.items()
+                           if entry['state'].get('status') in self.FINISHED), None)
+            if victim is None:
+                break
+            entry = self._jobs.pop(victim)
+            self._memory_bytes -= entry['size']
+            self._inputs.pop(victim, None)
+            self.evicted += 1
+
+    def _remove(self, job_id):
+        entry = self._jobs.pop(job_id, None)
+        if entry is not None:
+            self._memory_bytes -= entry['size']
+        self._inputs.pop(job_id, None)
+        if self._db is not None:
+            self._db.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+            self._db.commit()
+
+    def _prune(self):
+        """Supprime les jobs terminés expirés (verrou déjà acquis)"""
+        now = time.time()
+        expired = [job_id for job_id, entry in self._jobs.items()
+                   if self._is_expired(entry['state'], entry['updated_at'], now)]
+        for job_id in expired:
+            self._remove(job_id)
+        self.expired += len(expired)
+        if self._db is not None:
+            cursor = self._db.execute(
+                'DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?',
+                (*self.FINISHED, now - self.ttl)
+            )
+            self._db.commit()
+            self.expired += max(cursor.rowcount, 0)
+            self._fail_stale(now)
+
+    def _owner(self):
+        """Identifiant du processus courant (régénéré après un fork)"""
+        pid = os.getpid()
+        if self._owner_pid != pid:
+            self._owner_pid = pid
+            self._owner_id = f"{pid}-{uuid.uuid4().hex}"
+            self._heartbeat_thread = None
+        return self._owner_id
+
+    def _start_heartbeat(self):
+        """Démarre le battement de cœur de ce processus au premier job créé (verrou déjà acquis)"""
+        owner = self._owner()
+        if self._heartbeat_thread is not None or self.stale_after <= 0:
+            return
+        self._beat(time.time())
+        self._heartbeat_thread = threading.Thread(
+            target=self._heartbeat_loop, args=(owner,), daemon=True, name='job-store-heartbeat'
+        )
+        self._heartbeat_thread.start()
+
+    def _heartbeat_loop(self, owner):
+        interval = max(1.0, self.stale_after / 4)
+        while owner == self._owner_id:
+            time.sleep(interval)
+            with self._lock:
+                self._beat(time.time())
+
+    def _beat(self, now):
+        self._db.execute('INSERT OR REPLACE INTO owners (id, heartbeat) VALUES (?, ?)', (self._owner(), now))
+        self._db.commit()
+
+    def _fail_stale(self, now):
+        """Passe en erreur les jobs non terminés dont le processus propriétaire s'est arrêté
+
+        Un job en file d'attente n'est pas mis à jour : c'est le battement de cœur de son
+        propriétaire qui dit s'il vit encore. Les jobs de ce processus, et ceux des processus
+        ayant battu depuis moins de `stale_after` secondes, ne sont jamais touchés
+        (verrou déjà acquis).
+        """
+        if self.stale_after <= 0:
+            return
+        horizon = now - self.stale_after
+        rows = self._db.execute(
+            'SELECT id, state FROM jobs WHERE (status IS NULL OR status NOT IN (?, ?)) AND updated_at < ? '
+            "AND COALESCE(owner, '') != ? "
+            "AND COALESCE(owner, '') NOT IN (SELECT id FROM owners WHERE heartbeat >= ?)",
+            (*self.FINISHED, horizon, self._owner(), horizon)
+        ).fetchall()
+        self._db.execute('DELETE FROM owners WHERE heartbeat < ?', (horizon,))
+        for job_id, serialized in rows:
+            state = json.loads(serialized)
+            state.update(status='error', error="Analyse interrompue (processus arrêté)")
+            self._db.execute(
+                'UPDATE jobs SET state = ?, status = ?, updated_at = ? WHERE id = ?',
+                (json.dumps(state, default=json_default), 'error', now, job_id)
+            )
+            # Copie mémoire éventuelle (job d'un autre processus mis à jour ici) : relire la base
+            entry = self._jobs.pop(job_id, None)
+            if entry is not None:
+                self._memory_bytes -= entry['size']
+        self._db.commit()
+        if rows:
+            self.abandoned += len(rows)
+            print(f"{len(rows)} analyse(s) interrompue(s) marquée(s) en erreur")
+
+    def stats(self):
+        with self._lock:
+            return {
+                'jobs': len(self._jobs),
+                'memory_mb': round(self._memory_bytes / (1024 * 1024), 3),
+                'expired': self.expired,
+                'evicted': self.evicted,
+                'abandoned': self.abandoned,
+                'persistent': self._db is not None
+            }
+
+config = PLONKConfig()
+
+def get_cache_key(lat, lon):
+    """Génère une clé de cache pour les coordonnées (arrondie à ~100m)"""
+    # Arrondir à 3 décimales (~100m de précision) pour le cache
+    rounded_lat = round(lat, 3)
+    rounded_lon = round(lon, 3)
+    return f"{rounded_lat},{rounded_lon}"
+
+def default_location_info(lat, lon):
+    """Valeur par défaut si toutes les APIs échouent"""
+    return {
         'full_address': f"Lat: {lat:.6f}, Lon: {lon:.6f}",
         'city': 'Localisation en cours...',
         'country': 'Recherche en cours...',
@@ -160,17 +2007,80 @@ def get_location_info_detailed(lat, lon, retry_count=0):
         'suburb': '',
         'county': ''
     }
+
+def no_nearby_city_info(result, lat, lon):
+    """Résultat définitif du géocodeur hors ligne quand aucune ville n'est assez proche
+
+    Garde le pays trouvé par les polygones s'il y en a un.
+    """
+    info = default_location_info(lat, lon)
+    info['city'] = 'Aucune ville proche'
+    info['country'] = (result or {}).get('country') or 'Pays non identifié'
+    if result and result.get('full_address'):
+        info['full_address'] = result['full_address']
+    return info
+
+def clean_location_result(result, lat, lon):
+    """Filtre les résultats de mauvaise qualité ; retourne le résultat nettoyé ou None"""
+    if not result:
+        return None
+    # Vérifier que les résultats ne sont pas vides ou "inconnu"
+    city = result['city']
+    country = result['country']
+    if not city or city.lower() in ['unknown', 'inconnu', 'ville inconnue']:
+        return None
+    if not country or country.lower() in ['unknown', 'inconnu', 'pays inconnu']:
+        return None
+    return {
+        'full_address': result['full_address'] or f"Lat: {lat:.6f}, Lon: {lon:.6f}",
+        'city': city,
+        'country': country,
+        'state': result['state'] or '',
+        'road': result['road'] or '',
+        'house_number': result['house_number'] or '',
+        'postcode': result['postcode'] or '',
+        'suburb': result['suburb'] or '',
+        'county': result['county'] or ''
+    }
+
+def get_location_info_detailed(lat, lon):
+    """Récupère les informations de localisation avec plusieurs APIs et gestion des erreurs améliorée
+
+    Lève GeocodingUnavailable (avec retry_after) si les fournisseurs sont limités ou en pause :
+    l'échec n'est pas mis en cache et l'appelant peut réessayer.
+    """
+    # Géocodeur hors ligne en premier (ou exclusivement) s'il est configuré
+    if config.offline_geocoder is not None and config.geocoding_backend in ('offline', 'offline_first'):
+        result = config.offline_geocoder.lookup(lat, lon)
+        cleaned_result = clean_location_result(result, lat, lon)
+        if cleaned_result:
+            return cleaned_result
+        if config.geocoding_backend == 'offline':
+            return no_nearby_city_info(result, lat, lon)
     
-    # Ne pas mettre en cache les échecs pour permettre de réessayer plus tard
-    return default_info
+    # Vérifier le cache (y compris les échecs récents)
+    cache_key = get_cache_key(lat, lon)
+    found, cached = config.geocoding_cache.get(cache_key)
+    if found:
+        return cached if cached is not None else default_location_info(lat, lon)
+    
+    # Interroger les fournisseurs en parallèle, le premier résultat exploitable l'emporte
+    result = config.geocoding_client.reverse(
+        lat, lon, accept=lambda r: clean_location_result(r, lat, lon) is not None
+    )
+    
+    cleaned_result = clean_location_result(result, lat, lon)
+    if cleaned_result:
+        config.geocoding_cache.set(cache_key, cleaned_result)
+        return cleaned_result
+    
+    # Mettre l'échec en cache brièvement pour éviter de solliciter les APIs en boucle
+    config.geocoding_cache.set_failure(cache_key)
+    return default_location_info(lat, lon)
 
 def load_model(model_id):
-    """Charge le modèle PLONK"""
-    global config
-    if config.current_model != model_id:
-        config.pipeline = PlonkPipeline(model_id)
-        config.current_model = model_id
-    return config.pipeline
+    """Charge le modèle PLONK (via le pool de pipelines et les réglages d'inférence)"""
+    return config.model_pool.get(model_id)
 
 def process_coordinates(coords, max_results=65):
     """Traite les coordonnées retournées par PLONK"""
@@ -193,53 +2103,82 @@ def process_coordinates(coords, max_results=65):
         
     return points
 
-def calculate_distance_km(lat1, lon1, lat2, lon2):
-    """Calcule la distance en kilomètres entre deux points GPS en utilisant la formule de Haversine"""
-    R = 6371  # Rayon de la Terre en kilomètres
-    
-    lat1_rad = math.radians(lat1)
-    lon1_rad = math.radians(lon1)
-    lat2_rad = math.radians(lat2)
-    lon2_rad = math.radians(lon2)
+EARTH_RADIUS_KM = 6371  # Rayon de la Terre en kilomètres
+
+# Seuils usuels d'évaluation de la géolocalisation (rue, ville, région, pays, continent)
+DISTANCE_THRESHOLDS_KM = (1, 25, 200, 750, 2500)
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Calcule les distances de Haversine en kilomètres (tableaux NumPy, avec broadcasting)"""
+    lat1_rad = np.radians(np.asarray(lat1, dtype=float))
+    lon1_rad = np.radians(np.asarray(lon1, dtype=float))
+    lat2_rad = np.radians(np.asarray(lat2, dtype=float))
+    lon2_rad = np.radians(np.asarray(lon2, dtype=float))
     
     dlat = lat2_rad - lat1_rad
     dlon = lon2_rad - lon1_rad
     
-    a = math.sin(dlat/2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlon/2)**2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1_rad) * np.cos(lat2_rad) * np.sin(dlon / 2) ** 2
+    a = np.clip(a, 0.0, 1.0)
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
     
-    return R * c
+    return EARTH_RADIUS_KM * c
+
+def accuracy_from_distance(distance_km):
+    """Convertit des distances (km) en pourcentages de précision selon l'échelle par paliers"""
+    d = np.asarray(distance_km, dtype=float)
+    # Plus la distance est faible, plus la précision est élevée
+    conditions = [
+        d == 0,
+        d < 1,       # Moins de 1 km = très précis
+        d < 10,      # Moins de 10 km = précis
+        d < 100,     # Moins de 100 km = moyennement précis
+        d < 1000     # Moins de 1000 km = peu précis
+    ]
+    choices = [
+        np.full_like(d, 100.0),
+        np.maximum(90, 100 - (d * 10)),
+        np.maximum(70, 90 - ((d - 1) * 2.2)),
+        np.maximum(30, 70 - ((d - 10) * 0.44)),
+        np.maximum(5, 30 - ((d - 100) * 0.028))
+    ]
+    # Plus de 1000 km = très peu précis
+    return np.select(conditions, choices, default=np.maximum(0, 5 - ((d - 1000) * 0.001)))
+
+def score_predictions(pred_lats, pred_lons, true_lats, true_lons):
+    """Retourne (distances_km, accuracy_percent) pour des prédictions et une ou plusieurs vérités terrain"""
+    distances = haversine_km(true_lats, true_lons, pred_lats, pred_lons)
+    return distances, accuracy_from_distance(distances)
+
+def summarize_distances(distances_km):
+    """Statistiques agrégées d'un ensemble de distances d'erreur"""
+    d = np.asarray(distances_km, dtype=float).reshape(-1)
+    if d.size == 0:
+        return None
+    summary = {
+        'count': int(d.size),
+        'median_distance_km': round(float(np.median(d)), 2),
+        'mean_distance_km': round(float(np.mean(d)), 2),
+        'average_accuracy': round(float(np.mean(accuracy_from_distance(d))), 2)
+    }
+    for threshold in DISTANCE_THRESHOLDS_KM:
+        summary[f'within_{threshold}km_percent'] = round(float(np.mean(d <= threshold) * 100), 2)
+    return summary
 
 def calculate_prediction_accuracy(predicted_points, true_lat, true_lon):
     """Calcule la précision des prédictions par rapport à la vraie position"""
     if not predicted_points or true_lat is None or true_lon is None:
         return None
     
+    coordinates = np.array([
+        point['coordinates'] if isinstance(point, dict) and 'coordinates' in point else point
+        for point in predicted_points
+    ], dtype=float).reshape(-1, 2)
+    
+    distances, accuracies = score_predictions(coordinates[:, 0], coordinates[:, 1], true_lat, true_lon)
+    
     results = []
-    for point in predicted_points:
-        if isinstance(point, dict) and 'coordinates' in point:
-            pred_lat, pred_lon = point['coordinates']
-        else:
-            pred_lat, pred_lon = point
-        
-        distance_km = calculate_distance_km(true_lat, true_lon, pred_lat, pred_lon)
-        
-        # Calcul du pourcentage de précision basé sur la distance
-        # Plus la distance est faible, plus la précision est élevée
-        # Utilisation d'une échelle logarithmique pour une meilleure répartition
-        if distance_km == 0:
-            accuracy_percent = 100.0
-        elif distance_km < 1:  # Moins de 1 km = très précis
-            accuracy_percent = max(90, 100 - (distance_km * 10))
-        elif distance_km < 10:  # Moins de 10 km = précis
-            accuracy_percent = max(70, 90 - ((distance_km - 1) * 2.2))
-        elif distance_km < 100:  # Moins de 100 km = moyennement précis
-            accuracy_percent = max(30, 70 - ((distance_km - 10) * 0.44))
-        elif distance_km < 1000:  # Moins de 1000 km = peu précis
-            accuracy_percent = max(5, 30 - ((distance_km - 100) * 0.028))
-        else:  # Plus de 1000 km = très peu précis
-            accuracy_percent = max(0, 5 - ((distance_km - 1000) * 0.001))
-        
+    for (pred_lat, pred_lon), distance_km, accuracy_percent in zip(coordinates.tolist(), distances.tolist(), accuracies.tolist()):
         results.append({
             'predicted_lat': pred_lat,
             'predicted_lon': pred_lon,
@@ -249,54 +2188,293 @@ def calculate_prediction_accuracy(predicted_points, true_lat, true_lon):
     
     return results
 
-def find_most_frequent_positions(all_points, final_count, tolerance=0.01):
-    """Trouve les positions les plus fréquentes avec tolérance"""
-    if not all_points:
-        return []
-        
-    grouped_points = []
-    
-    for point in all_points:
-        lat, lon = point
-        found_group = False
-        
-        for group in grouped_points:
-            group_lat, group_lon, count = group['center'][0], group['center'][1], group['count']
-            
-            if abs(lat - group_lat) <= tolerance and abs(lon - group_lon) <= tolerance:
-                new_count = count + 1
-                new_lat = (group_lat * count + lat) / new_count
-                new_lon = (group_lon * count + lon) / new_count
-                
-                group['center'] = (new_lat, new_lon)
-                group['count'] = new_count
-                group['points'].append(point)
-                found_group = True
+class PositionClusterer:
+    """Regroupement incrémental des positions sur une grille spatiale vectorisée
+
+    Les points sont répartis dans une grille de cellules de taille `tolerance`
+    dont les effectifs sont cumulés d'un ajout à l'autre ; les cellules les plus
+    denses servent de germes. Un groupe reçoit les points de son voisinage 3x3
+    situés à moins de `tolerance` (en latitude et en longitude) du centre du germe,
+    y compris de part et d'autre de l'antiméridien.
+    """
+    def __init__(self, tolerance=0.01):
+        self.tolerance = tolerance
+        self.lon_cells = max(1, int(np.ceil(360.0 / tolerance)))
+        self.cell_keys = np.empty(0, dtype=np.int64)
+        self.counts = np.empty(0, dtype=np.int64)
+        self.first_index = np.empty(0, dtype=np.int64)
+        self._chunks = []  # Tableaux (lat, lon, clé de cellule) de chaque ajout
+        self.total_points = 0
+
+    def add(self, points):
+        """Ajoute des points (lat, lon) aux statistiques des cellules"""
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        if points.shape[0] == 0:
+            return self
+
+        lat = np.clip(points[:, 0], -90.0, 90.0)
+        lon = (points[:, 1] + 180.0) % 360.0 - 180.0
+
+        # Indexation des points dans la grille (les colonnes bouclent sur l'antiméridien)
+        cell_lat = np.floor((lat + 90.0) / self.tolerance).astype(np.int64)
+        cell_lon = np.floor((lon + 180.0) / self.tolerance).astype(np.int64) % self.lon_cells
+        keys = cell_lat * self.lon_cells + cell_lon
+
+        # Fusion avec les cellules déjà connues
+        all_keys = np.concatenate([self.cell_keys, keys])
+        cell_keys, inverse = np.unique(all_keys, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        known, added = inverse[:self.cell_keys.shape[0]], inverse[self.cell_keys.shape[0]:]
+        size = cell_keys.shape[0]
+
+        counts = np.bincount(known, weights=self.counts, minlength=size) + np.bincount(added, minlength=size)
+        first_index = np.full(size, np.iinfo(np.int64).max, dtype=np.int64)
+        np.minimum.at(first_index, known, self.first_index)
+        np.minimum.at(first_index, added, self.total_points + np.arange(keys.shape[0]))
+
+        self.cell_keys = cell_keys
+        self.counts = counts.astype(np.int64)
+        self.first_index = first_index
+        self._chunks.append((lat, lon, keys))
+        self.total_points += keys.shape[0]
+        return self
+
+    def top(self, final_count):
+        """Retourne les `final_count` groupes les plus fréquents"""
+        if self.total_points == 0 or final_count <= 0:
+            return []
+
+        cell_keys, counts, first_index = self.cell_keys, self.counts, self.first_index
+        lon_cells = self.lon_cells
+        lat = np.concatenate([chunk[0] for chunk in self._chunks])
+        lon = np.concatenate([chunk[1] for chunk in self._chunks])
+        point_keys = np.concatenate([chunk[2] for chunk in self._chunks])
+
+        # Points triés par cellule : ceux de la cellule c sont point_order[starts[c]:starts[c + 1]]
+        point_order = np.argsort(np.searchsorted(cell_keys, point_keys), kind='stable')
+        starts = np.concatenate([[0], np.cumsum(counts)])
+
+        # Indices des 9 cellules du voisinage 3x3 de chaque cellule (-1 si vide)
+        cells_lat = cell_keys // lon_cells
+        cells_lon = cell_keys % lon_cells
+        neighbours = np.full((cell_keys.shape[0], 9), -1, dtype=np.int64)
+        offsets = [(dlat, dlon) for dlat in (0, -1, 1) for dlon in (0, -1, 1)]
+        for j, (dlat, dlon) in enumerate(offsets):
+            neighbour_keys = (cells_lat + dlat) * lon_cells + (cells_lon + dlon) % lon_cells
+            positions = np.searchsorted(cell_keys, neighbour_keys)
+            positions = np.minimum(positions, cell_keys.shape[0] - 1)
+            found = (cell_keys[positions] == neighbour_keys) & (cells_lat + dlat >= 0)
+            neighbours[found, j] = positions[found]
+
+        # Germes par densité décroissante (à égalité : ordre d'apparition des points)
+        order = np.lexsort((first_index, -counts))
+
+        # Borne supérieure de la taille d'un groupe formé à partir des germes restants
+        neighbourhood_totals = np.where(neighbours >= 0, counts[neighbours], 0).sum(axis=1)
+        remaining_bound = np.maximum.accumulate(neighbourhood_totals[order][::-1])[::-1]
+
+        state = {'lat': lat, 'lon': lon, 'point_order': point_order, 'starts': starts,
+                 'neighbours': neighbours, 'assigned': np.zeros(self.total_points, dtype=bool)}
+        groups = []  # Tableaux (rang du germe, effectif, latitude, longitude) de chaque vague
+        kth_largest = None
+        position, chunk_size = 0, max(16, 4 * final_count)
+        while position < order.shape[0]:
+            if kth_largest is not None and remaining_bound[position] <= kth_largest:
                 break
-                
-        if not found_group:
-            grouped_points.append({
-                'center': point,
-                'count': 1,
-                'points': [point]
+            seeds = order[position:position + chunk_size]
+            ranks = np.arange(position, position + seeds.shape[0])
+
+            # Vagues de germes indépendants : un germe attend tant qu'un germe antérieur du lot,
+            # à moins de deux cellules (voisinages 3x3 qui se recouvrent), n'est pas traité
+            later, earlier = self._conflicts(seeds, cells_lat, cells_lon)
+            pending = np.ones(seeds.shape[0], dtype=bool)
+            while pending.any():
+                blocked = np.zeros(seeds.shape[0], dtype=bool)
+                blocked[later[pending[earlier]]] = True
+                ready = pending & ~blocked
+                groups.append(self._grow(state, seeds[ready], ranks[ready]))
+                pending &= ~ready
+
+            position += seeds.shape[0]
+            chunk_size = min(chunk_size * 2, 8192)
+            all_counts = np.concatenate([group[1] for group in groups])
+            if all_counts.shape[0] >= final_count:
+                kth_largest = np.partition(all_counts, -final_count)[-final_count]
+
+        ranks, group_counts, center_lat, center_lon = (np.concatenate(column) for column in zip(*groups))
+        # Effectif décroissant, puis ordre des germes (comme un traitement germe par germe)
+        best = np.lexsort((ranks, -group_counts))[:final_count]
+
+        result_points = []
+        for i in best:
+            result_points.append({
+                'coordinates': (float(center_lat[i]), float(center_lon[i])),
+                'confidence': int(group_counts[i]),
+                'total_points': int(group_counts[i])
             })
-            
-    grouped_points.sort(key=lambda x: x['count'], reverse=True)
-    
-    result_points = []
-    for group in grouped_points[:final_count]:
-        result_points.append({
-            'coordinates': group['center'],
-            'confidence': group['count'],
-            'total_points': len(group['points'])
-        })
         
-    return result_points
+        return result_points
+
+    def _conflicts(self, seeds, cells_lat, cells_lon):
+        """Paires (germe, germe antérieur du même lot) dont les voisinages 3x3 se recouvrent"""
+        later, earlier = [], []
+        local = np.arange(seeds.shape[0])
+        # Recherche parmi les seules cellules du lot : (clé triée, position dans le lot)
+        by_key = np.argsort(self.cell_keys[seeds])
+        sorted_keys = self.cell_keys[seeds][by_key]
+        for dlat in range(-2, 3):
+            for dlon in range(-2, 3):
+                if dlat == 0 and dlon == 0:
+                    continue
+                neighbour_keys = ((cells_lat[seeds] + dlat) * self.lon_cells
+                                  + (cells_lon[seeds] + dlon) % self.lon_cells)
+                found_at = np.minimum(np.searchsorted(sorted_keys, neighbour_keys), seeds.shape[0] - 1)
+                found = (sorted_keys[found_at] == neighbour_keys) & (cells_lat[seeds] + dlat >= 0)
+                neighbour_local = by_key[found_at]
+                conflict = found & (neighbour_local < local)
+                later.append(local[conflict])
+                earlier.append(neighbour_local[conflict])
+        return np.concatenate(later), np.concatenate(earlier)
+
+    def _grow(self, state, seeds, ranks):
+        """Forme les groupes de germes indépendants en une seule passe vectorisée"""
+        lat, lon, assigned = state['lat'], state['lon'], state['assigned']
+        point_order, starts = state['point_order'], state['starts']
+        tolerance = self.tolerance
+
+        # Centre de chaque germe : moyenne de ses points encore libres
+        # (une cellule ne chevauche pas l'antiméridien)
+        indices, owner = expand_ranges(starts[seeds], starts[seeds + 1] - starts[seeds])
+        seed_points = point_order[indices]
+        free = ~assigned[seed_points]
+        seed_points, owner = seed_points[free], owner[free]
+        free_counts = np.bincount(owner, minlength=seeds.shape[0])
+        keep = free_counts > 0
+        seed_lat = np.bincount(owner, weights=lat[seed_points], minlength=seeds.shape[0])[keep] / free_counts[keep]
+        seed_lon = np.bincount(owner, weights=lon[seed_points], minlength=seeds.shape[0])[keep] / free_counts[keep]
+        seeds, ranks = seeds[keep], ranks[keep]
+
+        # Points libres du voisinage 3x3 de chaque germe
+        cells = state['neighbours'][seeds]
+        if self.lon_cells < 3:
+            # Voisines confondues lorsque la grille a moins de 3 colonnes
+            cells = np.sort(cells, axis=1)
+            cells[:, 1:][cells[:, 1:] == cells[:, :-1]] = -1
+        rows, columns = np.nonzero(cells >= 0)
+        cells = cells[rows, columns]
+        indices, segment = expand_ranges(starts[cells], starts[cells + 1] - starts[cells])
+        candidates, owner = point_order[indices], rows[segment]
+        free = ~assigned[candidates]
+        candidates, owner = candidates[free], owner[free]
+
+        lon_offsets = (lon[candidates] - seed_lon[owner] + 180.0) % 360.0 - 180.0
+        inside = (np.abs(lat[candidates] - seed_lat[owner]) <= tolerance) & (np.abs(lon_offsets) <= tolerance)
+        members, owner, lon_offsets = candidates[inside], owner[inside], lon_offsets[inside]
+        assigned[members] = True
+
+        group_counts = np.bincount(owner, minlength=seeds.shape[0])
+        divisor = np.maximum(group_counts, 1)
+        center_lat = np.bincount(owner, weights=lat[members], minlength=seeds.shape[0]) / divisor
+        # Longitudes dépliées autour du germe avant de moyenner
+        center_lon = seed_lon + np.bincount(owner, weights=lon_offsets, minlength=seeds.shape[0]) / divisor
+        center_lon = (center_lon + 180.0) % 360.0 - 180.0
+        return ranks, group_counts, center_lat, center_lon
+
+def expand_ranges(starts, lengths):
+    """Concatène les intervalles [starts[i], starts[i] + lengths[i]) ; retourne (indices, numéro d'intervalle)"""
+    lengths = np.asarray(lengths, dtype=np.int64)
+    segment = np.repeat(np.arange(lengths.shape[0]), lengths)
+    offsets = np.cumsum(lengths) - lengths
+    return np.repeat(np.asarray(starts, dtype=np.int64) - offsets, lengths) + np.arange(segment.shape[0]), segment
+
+def find_most_frequent_positions(all_points, final_count, tolerance=0.01):
+    """Trouve les positions les plus fréquentes avec tolérance (grille spatiale vectorisée)"""
+    return PositionClusterer(tolerance).add(all_points).top(final_count)
+
+def clusters_converged(previous, current, tolerance_km):
+    """Vrai si les groupes gardent le même rang et des centres à moins de tolerance_km"""
+    if not previous or len(previous) != len(current):
+        return False
+    previous_centers = np.array([group['coordinates'] for group in previous])
+    current_centers = np.array([group['coordinates'] for group in current])
+    distances = haversine_km(previous_centers[:, 0], previous_centers[:, 1],
+                             current_centers[:, 0], current_centers[:, 1])
+    return bool(np.all(distances <= tolerance_km))
 
 @app.route('/')
 def index():
     return render_template('index.html', models=config.models_info)
 
+@app.route('/health', methods=['GET'])
+def health():
+    """Vivacité : le serveur HTTP répond, que les modèles soient chargés ou non"""
+    return jsonify({'status': 'ok'})
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Disponibilité : 200 une fois les modèles préchargés, 503 pendant le préchargement"""
+    # Sous un serveur WSGI externe, la première sonde déclenche le préchargement
+    config.model_preloader.start()
+    stats = config.model_preloader.stats()
+    return jsonify(stats), 200 if stats['ready'] else 503
+
+@app.route('/get_model_stats', methods=['GET'])
+def get_model_stats():
+    """Endpoint pour consulter l'état du pool de modèles"""
+    stats = config.model_pool.stats()
+    stats['inference'] = config.inference_scheduler.stats()
+    stats['inference_backend'] = config.inference_backend.stats()
+    stats['preloader'] = config.model_preloader.stats()
+    stats['prediction_cache'] = config.prediction_cache.stats()
+    stats['analysis_pool'] = config.analysis_pool.stats()
+    stats['job_store'] = config.job_store.stats()
+    return jsonify(stats)
+
+@app.route('/get_geocoding_stats', methods=['GET'])
+def get_geocoding_stats():
+    """Endpoint pour consulter les compteurs du cache de géocodage"""
+    stats = config.geocoding_cache.stats()
+    stats['providers'] = config.geocoding_client.stats()
+    stats['coalescer'] = config.geocoding_coalescer.stats()
+    return jsonify(stats)
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Endpoint de métriques au format texte Prometheus"""
+    pool = config.model_pool.stats()
+    analysis = config.analysis_pool.stats()
+    geocoding = config.geocoding_cache.stats()
+    providers = config.geocoding_client.stats()
+    predictions = config.prediction_cache.stats()
+    samples = [
+        ('plonk_model_loads_total', 'counter', "Chargements de modèles", [({}, pool['loads'])]),
+        ('plonk_model_evictions_total', 'counter', "Modèles évincés du pool (changements de modèle)",
+         [({}, pool['evictions'])]),
+        ('plonk_models_loaded', 'gauge', "Modèles actuellement en mémoire", [({}, len(pool['loaded_models']))]),
+        ('plonk_geocode_cache_hits_total', 'counter', "Géocodages servis par le cache",
+         [({'result': 'found'}, geocoding['hits']), ({'result': 'negative'}, geocoding['negative_hits'])]),
+        ('plonk_geocode_cache_misses_total', 'counter', "Géocodages absents du cache", [({}, geocoding['misses'])]),
+        ('plonk_geocode_provider_requests_total', 'counter', "Requêtes envoyées aux fournisseurs de géocodage",
+         [({'provider': name}, stats['requests']) for name, stats in providers.items()]),
+        ('plonk_geocode_provider_failures_total', 'counter', "Échecs des fournisseurs de géocodage",
+         [({'provider': name}, stats['failures']) for name, stats in providers.items()]),
+        ('plonk_geocode_provider_retries_total', 'counter', "Relances vers un fournisseur de géocodage",
+         [({'provider': name}, stats['retries']) for name, stats in providers.items()]),
+        ('plonk_geocode_provider_throttled_total', 'counter', "Requêtes retardées par la limite de débit",
+         [({'provider': name}, stats['throttled']) for name, stats in providers.items()]),
+        ('plonk_prediction_cache_hits_total', 'counter', "Analyses servies par le cache de prédictions",
+         [({}, predictions['hits'])]),
+        ('plonk_prediction_cache_misses_total', 'counter', "Analyses absentes du cache de prédictions",
+         [({}, predictions['misses'])]),
+        ('plonk_analyses_active', 'gauge', "Analyses en cours de traitement", [({}, analysis['active'])]),
+        ('plonk_analysis_queue_depth', 'gauge', "Analyses en file d'attente",
+         [({'lane': lane}, depth) for lane, depth in analysis['queued'].items()]),
+        ('plonk_analyses_completed_total', 'counter', "Analyses terminées", [({}, analysis['completed'])]),
+        ('plonk_analyses_rejected_total', 'counter', "Analyses refusées (file pleine)", [({}, analysis['rejected'])]),
+        ('plonk_jobs', 'gauge', "Analyses conservées dans le stockage", [({}, config.job_store.stats()['jobs'])])
+    ]
+    return Response(config.metrics.render(samples), mimetype='text/plain; version=0.0.4')
+
 @app.route('/get_location_details', methods=['POST'])
 def get_location_details():
     """Endpoint pour récupérer les détails de localisation en arrière-plan avec priorisation"""
@@ -309,7 +2487,7 @@ def get_location_details():
         lon = float(data.get('lon'))
         result_index = int(data.get('result_index', 0))
         
-        location_info = get_location_info_detailed(lat, lon)
+        location_info = geocode_coalesced(lat, lon).result()
         
         return jsonify({
             'success': True,
@@ -317,115 +2495,324 @@ def get_location_details():
             'result_index': result_index
         })
         
+    except GeocodingUnavailable as e:
+        return geocoding_unavailable_response(e, result_index)
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
-# Variable globale pour stocker l'état des analyses
-analysis_progress = {}
+def geocoding_unavailable_response(error, result_index):
+    """Réponse HTTP 503 avec Retry-After lorsque les fournisseurs de géocodage sont limités"""
+    retry_after = error.retry_after if error.retry_after is not None else 1.0
+    response = jsonify({'success': False, 'error': str(error), 'retry_after': round(retry_after, 2),
+                        'result_index': result_index})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(max(1, int(math.ceil(retry_after))))
+    return response
+
+def geocode_coalesced(lat, lon):
+    """Géocodage partagé entre toutes les requêtes en cours sur la même cellule de cache"""
+    return config.geocoding_coalescer.submit(get_cache_key(lat, lon), get_location_info_detailed, lat, lon)
+
+@app.route('/get_location_details_batch', methods=['POST'])
+def get_location_details_batch():
+    """Géocode une liste de points et renvoie chaque résultat (NDJSON) dès qu'il est disponible"""
+    try:
+        data = request.get_json()
+        points = data.get('points') if data else None
+        if not points:
+            return jsonify({'success': False, 'error': 'Aucune donnée reçue'}), 400
+        if len(points) > config.max_geocoding_batch:
+            return jsonify({'success': False, 'error': f'Maximum {config.max_geocoding_batch} points par requête'}), 400
+        
+        # Regrouper les points par clé de cache : une seule recherche par cellule
+        groups = OrderedDict()
+        for i, point in enumerate(points):
+            lat = float(point.get('lat'))
+            lon = float(point.get('lon'))
+            result_index = int(point.get('result_index', i))
+            groups.setdefault(get_cache_key(lat, lon), []).append((lat, lon, result_index))
+        
+        # Résolution hors ligne groupée, le reste passe par les fournisseurs en ligne
+        offline_results = {}
+        if config.offline_geocoder is not None and config.geocoding_backend in ('offline', 'offline_first'):
+            leaders = [members[0] for members in groups.values()]
+            found = config.offline_geocoder.lookup_many([p[0] for p in leaders], [p[1] for p in leaders])
+            for key, (lat, lon, _), result in zip(groups.keys(), leaders, found):
+                cleaned_result = clean_location_result(result, lat, lon)
+                if cleaned_result is None and config.geocoding_backend == 'offline':
+                    cleaned_result = no_nearby_city_info(result, lat, lon)
+                if cleaned_result is not None:
+                    offline_results[key] = cleaned_result
+        
+        futures = {}
+        for key, members in groups.items():
+            lat, lon, _ = members[0]
+            if key in offline_results:
+                future = Future()
+                future.set_result(offline_results[key])
+            else:
+                future = geocode_coalesced(lat, lon)
+            futures[future] = members
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+    
+    def generate():
+        for future in as_completed(futures):
+            for lat, lon, result_index in futures[future]:
+                try:
+                    line = {'success': True, 'location_info': future.result(), 'result_index': result_index}
+                except GeocodingUnavailable as e:
+                    # Fournisseurs limités : le client redemandera ce point après retry_after
+                    retry_after = e.retry_after if e.retry_after is not None else 1.0
+                    line = {'success': False, 'error': str(e), 'retry_after': round(retry_after, 2),
+                            'result_index': result_index}
+                except Exception as e:
+                    line = {'success': False, 'error': str(e), 'result_index': result_index}
+                line['lat'] = lat
+                line['lon'] = lon
+                yield json.dumps(line, ensure_ascii=False) + '\n'
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
 
 @app.route('/get_progress/<analysis_id>', methods=['GET'])
 def get_analysis_progress(analysis_id):
     """Endpoint pour récupérer le progrès d'une analyse"""
-    progress = analysis_progress.get(analysis_id, {'current': 0, 'total': 1, 'status': 'unknown'})
-    return jsonify(progress)
+    progress = config.job_store.get(analysis_id) or {'current': 0, 'total': 1, 'status': 'unknown'}
+    return jsonify(public_progress(progress, analysis_id))
+
+def decode_image(source, max_side=None):
+    """Décode une image (flux ou octets) en RGB réduite, sans copie intermédiaire"""
+    max_side = max_side or config.max_image_side
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    img = Image.open(source)
+    # Pour les JPEG, réduire directement au décodage (échelle DCT)
+    img.draft('RGB', (max_side, max_side))
+    img = img.convert('RGB')
+    img.thumbnail((max_side, max_side))
+    return img
+
+def image_content_hash(img):
+    """Empreinte SHA-256 du contenu d'une image décodée"""
+    digest = hashlib.sha256(f"{img.mode}{img.size}".encode('utf-8'))
+    digest.update(img.tobytes())
+    return digest.hexdigest()
+
+def parse_bool(value):
+    """Interprète un booléen reçu en JSON ou en champ de formulaire"""
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'on', 'yes')
+    return bool(value)
+
+def parse_analysis_params(data):
+    """Normalise les paramètres d'analyse (JSON, formulaire ou query string)"""
+    precision_mode = parse_bool(data.get('precision_mode', False))
+    max_results = int(data.get('max_results', 65))
+    return {
+        'model': data.get('model') or 'nicolas-dufour/PLONK_YFCC',
+        'max_results': max_results,
+        'precision_mode': precision_mode,
+        'iterations': int(data.get('iterations', 3)) if precision_mode else 1,
+        'final_results': int(data.get('final_results', 5)) if precision_mode else max_results,
+        # Arrêt anticipé lorsque les groupes principaux sont stables (en km)
+        'early_stop': parse_bool(data.get('early_stop', False)),
+        'convergence_km': float(data.get('convergence_km') or 1.0),
+        # Mode test de prédiction
+        'test_mode': parse_bool(data.get('test_mode', False)),
+        'true_lat': float(data.get('true_lat')) if data.get('true_lat') else None,
+        'true_lon': float(data.get('true_lon')) if data.get('true_lon') else None
+    }
+
+def launch_analysis(params, img, timings=None):
+    """Enregistre l'analyse et la démarre en arrière-plan ; retourne son ID"""
+    # Initialiser le progrès : seule l'image décodée est conservée, pas les octets reçus
+    analysis_id = config.job_store.create(
+        {'current': 0, 'total': params['iterations'], 'status': 'queued', 'params': params,
+         'timings': dict(timings or {}), 'submitted_at': time.time()},
+        inputs={'image': img}
+    )
+    
+    # Mettre l'analyse en file : les analyses en une passe n'attendent pas derrière le mode précision
+    lane = 'heavy' if params['precision_mode'] and params['iterations'] > 1 else 'quick'
+    try:
+        config.analysis_pool.submit(analysis_id, process_analysis, lane)
+    except QueueFull:
+        config.job_store.delete(analysis_id)
+        raise
+    return analysis_id
+
+def queue_full_response(error):
+    """Réponse HTTP 429 avec Retry-After lorsque la file d'analyses est pleine"""
+    response = jsonify({'success': False, 'error': str(error), 'retry_after': error.retry_after})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
 
 @app.route('/start_analysis', methods=['POST'])
 def start_analysis():
-    """Démarre une analyse et retourne immédiatement l'ID"""
+    """Démarre une analyse (image en data URL base64 dans le JSON) et retourne immédiatement l'ID"""
     try:
         data = request.get_json()
+        if not data or not data.get('image'):
+            return jsonify({'success': False, 'error': 'Aucune image fournie'}), 400
         
-        # Générer un ID unique pour cette analyse
-        analysis_id = str(int(time.time() * 1000)) + '_' + str(hash(str(data)) % 10000)
+        config.analysis_pool.ensure_capacity()
+        params = parse_analysis_params(data)
         
-        # Paramètres
-        precision_mode = data.get('precision_mode', False)
-        iterations = int(data.get('iterations', 3)) if precision_mode else 1
+        # Décoder l'image base64
+        image_data = data['image'].split(',')[-1]  # Supprimer le préfixe data:image/...
+        with config.metrics.timer('plonk_decode_seconds') as decode_timer:
+            img = decode_image(base64.b64decode(image_data))
         
-        # Initialiser le progrès
-        analysis_progress[analysis_id] = {
-            'current': 0,
-            'total': iterations,
-            'status': 'starting',
-            'data': data  # Stocker les données pour l'analyse
-        }
+        return jsonify({
+            'success': True,
+            'analysis_id': launch_analysis(params, img, timings={'decode': decode_timer.elapsed})
+        })
         
-        # Démarrer l'analyse en arrière-plan
-        threading.Thread(target=process_analysis, args=(analysis_id,)).start()
+    except QueueFull as e:
+        return queue_full_response(e)
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/start_analysis_upload', methods=['POST'])
+def start_analysis_upload():
+    """Démarre une analyse à partir d'une image binaire (multipart ou corps brut)
+
+    Multipart : champ `image` + paramètres en champs de formulaire.
+    Corps brut (Content-Type image/*) : paramètres dans la query string.
+    """
+    try:
+        config.analysis_pool.ensure_capacity()
+        if 'image' in request.files:
+            params = parse_analysis_params(request.form)
+            source = request.files['image'].stream
+        elif request.mimetype.startswith('image/') or request.mimetype == 'application/octet-stream':
+            params = parse_analysis_params(request.args)
+            source = request.stream
+        else:
+            return jsonify({'success': False, 'error': 'Aucune image fournie'}), 400
+        with config.metrics.timer('plonk_decode_seconds') as decode_timer:
+            img = decode_image(source)
         
         return jsonify({
             'success': True,
-            'analysis_id': analysis_id
+            'analysis_id': launch_analysis(params, img, timings={'decode': decode_timer.elapsed})
         })
         
+    except QueueFull as e:
+        return queue_full_response(e)
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 def process_analysis(analysis_id):
     """Traite l'analyse en arrière-plan"""
+    started = time.perf_counter()
+    status = 'error'
     try:
-        # Récupérer les données de l'analyse
-        progress_data = analysis_progress[analysis_id]
-        data = progress_data['data']
+        # Récupérer les paramètres et l'image décodée, puis libérer l'image du store
+        job = config.job_store.get(analysis_id)
+        params = job['params']
+        # Durées par étape (en secondes), renvoyées avec les résultats
+        timings = dict(job.get('timings') or {})
+        timings['queue_wait'] = max(0.0, time.time() - job.get('submitted_at', time.time()))
+        timings.update(inference=0.0, clustering=0.0, iterations=[])
+        img = config.job_store.pop_input(analysis_id, 'image')
+        if img is None:
+            raise ValueError('Aucune image fournie')
         
         # Paramètres
-        model_id = data.get('model', 'nicolas-dufour/PLONK_YFCC')
-        max_results = int(data.get('max_results', 65))
-        precision_mode = data.get('precision_mode', False)
-        iterations = int(data.get('iterations', 3)) if precision_mode else 1
-        final_results = int(data.get('final_results', 5)) if precision_mode else max_results
+        model_id = params['model']
+        max_results = params['max_results']
+        precision_mode = params['precision_mode']
+        iterations = params['iterations']
+        final_results = params['final_results']
         
         # Mode test de prédiction
-        test_mode = data.get('test_mode', False)
-        true_lat = float(data.get('true_lat', 0)) if data.get('true_lat') else None
-        true_lon = float(data.get('true_lon', 0)) if data.get('true_lon') else None
+        test_mode = params['test_mode']
+        true_lat = params['true_lat']
+        true_lon = params['true_lon']
         
-        # Image
-        image_data = data.get('image')
-        if not image_data:
-            analysis_progress[analysis_id]['status'] = 'error'
-            analysis_progress[analysis_id]['error'] = 'Aucune image fournie'
-            return
-            
-        # Décoder l'image base64
-        image_data = image_data.split(',')[1]  # Supprimer le préfixe data:image/...
-        image_bytes = base64.b64decode(image_data)
-        img = Image.open(io.BytesIO(image_bytes)).convert('RGB')
+        all_points = []
         
-        # Charger le modèle
-        pipeline = load_model(model_id)
+        # Analyse(s) : en mode précision, tous les échantillons sont tirés en un seul appel,
+        # sauf si l'arrêt anticipé est demandé (tirage itération par itération)
+        config.job_store.update(analysis_id, current=0, total=iterations, status='running')
+        num_samples = iterations * max_results
+        early_stop = precision_mode and params.get('early_stop', False) and iterations > 1
         
-        all_points = []
+        # Réutiliser les échantillons d'une analyse précédente de la même image
+        image_hash = image_content_hash(img)
+        coords = config.prediction_cache.get(image_hash, model_id, num_samples,
+                                             config.inference_backend.sampling_params(model_id))
+        cache_hit = coords is not None
+        drawn = []
+        if not cache_hit and not early_stop:
+            inference_started = time.perf_counter()
+            coords = config.inference_scheduler.submit(model_id, img, num_samples, key=image_hash).result()
+            timings['inference'] += time.perf_counter() - inference_started
+            config.prediction_cache.put(image_hash, model_id, coords,
+                                        config.inference_backend.sampling_params(model_id))
         
-        # Analyse(s)
+        # Les cellules sont mises à jour à chaque itération ; les groupes ne sont formés
+        # par itération qu'avec l'arrêt anticipé (échantillons réellement tirés au fil de l'eau),
+        # sinon une seule fois à la fin
+        clusterer = PositionClusterer()
+        previous_top = None
+        stable = 0
+        converged = False
+        iterations_run = 0
         for i in range(iterations):
-            # Mettre à jour le progrès
-            analysis_progress[analysis_id] = {
-                'current': i + 1,
-                'total': iterations,
-                'status': 'running'
-            }
-            
-            try:
-                coords = pipeline([img], batch_size=1024)
-                points = process_coordinates(coords, max_results)
-                
-                if precision_mode:
-                    all_points.extend([(lat, lon) for lat, lon in points])
+            iteration_started = time.perf_counter()
+            if coords is not None:
+                batch = coords[i * max_results:(i + 1) * max_results]
+            else:
+                batch = config.inference_scheduler.submit(model_id, img, max_results, key=image_hash).result()
+                timings['inference'] += time.perf_counter() - iteration_started
+                drawn.append(batch)
+            points = process_coordinates(batch, max_results)
+            all_points.extend(points)
+            iterations_run = i + 1
+            # Publier les groupes provisoires après chaque itération (arrêt anticipé)
+            partial_results = None
+            if precision_mode:
+                clusterer.add(points)
+            if early_stop:
+                with config.metrics.timer('plonk_clustering_seconds') as clustering_timer:
+                    top = clusterer.top(final_results)
+                timings['clustering'] += clustering_timer.elapsed
+                partial_results = [{
+                    'latitude': point['coordinates'][0],
+                    'longitude': point['coordinates'][1],
+                    'confidence': point['confidence']
+                } for point in top]
+                # Convergence : centres et rangs stables sur plusieurs itérations consécutives
+                if previous_top is not None and clusters_converged(previous_top, top, params['convergence_km']):
+                    stable += 1
                 else:
-                    all_points = [(lat, lon) for lat, lon in points]
-                    break
-            except Exception as e:
-                print(f"Erreur lors de l'itération {i+1}: {e}")
-                continue
+                    stable = 0
+                previous_top = top
+            config.job_store.update(analysis_id, current=i + 1, partial_results=partial_results)
+            iteration_seconds = time.perf_counter() - iteration_started
+            timings['iterations'].append(iteration_seconds)
+            config.metrics.observe('plonk_iteration_seconds', iteration_seconds, model=model_id)
+            # Convergence seulement si des itérations ont vraiment été économisées
+            if early_stop and stable >= config.convergence_patience and iterations_run < iterations:
+                converged = True
+                break
         
-        # Marquer comme terminé
-        analysis_progress[analysis_id]['current'] = iterations
-        analysis_progress[analysis_id]['status'] = 'completed'
+        # Conserver les échantillons tirés pour une prochaine analyse de la même image
+        if drawn:
+            config.prediction_cache.put(image_hash, model_id, np.concatenate(drawn),
+                                        config.inference_backend.sampling_params(model_id))
         
         # Traitement final
-        if precision_mode and len(all_points) > 0:
-            result_points = find_most_frequent_positions(all_points, final_results)
+        if early_stop and previous_top is not None:
+            # Groupes déjà formés après la dernière itération
+            result_points = previous_top
+        elif precision_mode and len(all_points) > 0:
+            with config.metrics.timer('plonk_clustering_seconds') as clustering_timer:
+                result_points = clusterer.top(final_results)
+            timings['clustering'] += clustering_timer.elapsed
         else:
             result_points = [{
                 'coordinates': (lat, lon),
@@ -435,8 +2822,15 @@ def process_analysis(analysis_id):
         
         # Calcul de la précision en mode test
         test_results = None
+        raw_test_summary = None
+        scoring_started = time.perf_counter()
         if test_mode and true_lat is not None and true_lon is not None:
             test_results = calculate_prediction_accuracy(result_points, true_lat, true_lon)
+            # Évaluer aussi chaque échantillon brut, avant regroupement
+            raw_points = np.asarray(all_points, dtype=float).reshape(-1, 2)
+            raw_distances, _ = score_predictions(raw_points[:, 0], raw_points[:, 1], true_lat, true_lon)
+            raw_test_summary = summarize_distances(raw_distances)
+        timings['scoring'] = time.perf_counter() - scoring_started
         
         # Créer les résultats sans géocodage initial
         results_without_location = []
@@ -457,39 +2851,104 @@ def process_analysis(analysis_id):
             })
 
         # Stocker les résultats dans le progrès
-        analysis_progress[analysis_id]['results'] = {
+        results = {
             'success': True,
             'results': results_without_location,
             'total_found': len(results_without_location),
             'precision_mode': precision_mode,
-            'iterations': iterations if precision_mode else 1
+            'iterations': iterations if precision_mode else 1,
+            'iterations_run': iterations_run,
+            'converged': converged,
+            'cache_hit': cache_hit,
+            'timings': timings
         }
         
         # Ajouter les résultats du test si disponibles
         if test_mode:
-            analysis_progress[analysis_id]['results']['test_mode'] = True
-            analysis_progress[analysis_id]['results']['true_coordinates'] = {'lat': true_lat, 'lon': true_lon}
-            analysis_progress[analysis_id]['results']['test_results'] = test_results
+            results['test_mode'] = True
+            results['true_coordinates'] = {'lat': true_lat, 'lon': true_lon}
+            results['test_results'] = test_results
             
             # Calculer la précision moyenne
             if test_results:
                 avg_accuracy = sum(r['accuracy_percent'] for r in test_results) / len(test_results)
                 best_accuracy = max(r['accuracy_percent'] for r in test_results)
                 min_distance = min(r['distance_km'] for r in test_results)
-                analysis_progress[analysis_id]['results']['test_summary'] = {
+                results['test_summary'] = {
                     'average_accuracy': round(avg_accuracy, 2),
                     'best_accuracy': round(best_accuracy, 2),
                     'minimum_distance_km': round(min_distance, 2)
                 }
+            if raw_test_summary:
+                results['raw_test_summary'] = raw_test_summary
+        
+        # Marquer comme terminé
+        timings['total'] = timings['queue_wait'] + time.perf_counter() - started + timings.get('decode', 0.0)
+        for key, value in timings.items():
+            timings[key] = [round(v, 4) for v in value] if isinstance(value, list) else round(value, 4)
+        config.job_store.update(analysis_id, current=iterations_run, total=iterations_run, status='completed', results=results)
+        status = 'completed'
         
     except Exception as e:
-        analysis_progress[analysis_id]['status'] = 'error'
-        analysis_progress[analysis_id]['error'] = str(e)
+        config.job_store.update(analysis_id, status='error', error=str(e))
+    finally:
+        config.metrics.observe('plonk_analysis_seconds', time.perf_counter() - started, status=status)
+
+def public_progress(progress, analysis_id, partial=True):
+    """Champs du progrès exposés aux clients (groupes provisoires compris, sauf partial=False)"""
+    keys = ('current', 'total', 'status', 'error') + (('partial_results',) if partial else ())
+    response = {key: progress[key] for key in keys if key in progress}
+    if response.get('status') == 'queued':
+        response['queue_position'] = config.analysis_pool.position(analysis_id)
+    return response
+
+def sse_event(event, data):
+    """Formate un événement Server-Sent Events"""
+    return f"event: {event}\ndata: {json.dumps(data, default=json_default, ensure_ascii=False)}\n\n"
+
+@app.route('/stream/<analysis_id>', methods=['GET'])
+def stream_analysis(analysis_id):
+    """Pousse le progrès, les résultats provisoires puis les résultats finaux (Server-Sent Events)"""
+    def generate():
+        last_version = None
+        last_progress = None
+        last_partial = None
+        while True:
+            progress, version = config.job_store.wait_for_update(analysis_id, last_version)
+            if progress is None:
+                yield sse_event('failed', {'success': False, 'error': 'Analyse introuvable'})
+                return
+            if version == last_version:
+                yield ': keep-alive\n\n'
+                continue
+            last_version = version
+            
+            # Les groupes provisoires ont leur propre événement 'partial'
+            current_progress = public_progress(progress, analysis_id, partial=False)
+            if current_progress != last_progress:
+                last_progress = current_progress
+                yield sse_event('progress', current_progress)
+            if progress.get('partial_results') and progress['partial_results'] != last_partial:
+                last_partial = progress['partial_results']
+                yield sse_event('partial', {'results': last_partial, 'current': progress.get('current')})
+            
+            if progress['status'] == 'completed' and 'results' in progress:
+                yield sse_event('result', progress['results'])
+                return
+            if progress['status'] == 'error':
+                yield sse_event('failed', {'success': False, 'error': progress.get('error', 'Erreur inconnue')})
+                return
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 
 @app.route('/get_results/<analysis_id>', methods=['GET'])
 def get_analysis_results(analysis_id):
     """Récupère les résultats d'une analyse terminée"""
-    progress = analysis_progress.get(analysis_id)
+    progress = config.job_store.get(analysis_id)
     if not progress:
         return jsonify({'success': False, 'error': 'Analyse introuvable'}), 404
     
@@ -500,6 +2959,189 @@ def get_analysis_results(analysis_id):
     else:
         return jsonify({'success': False, 'error': 'Analyse en cours'}), 202
 
+def read_evaluation_manifest(manifest_path):
+    """Lit un manifeste CSV ou JSONL (image, lat, lon) entrée par entrée"""
+    def normalize(row):
+        image = row.get('image') or row.get('path') or row.get('filename')
+        lat = row.get('lat', row.get('latitude'))
+        lon = row.get('lon', row.get('longitude'))
+        if not image or lat in (None, '') or lon in (None, ''):
+            return None
+        return {'image': str(image), 'lat': float(lat), 'lon': float(lon)}
+
+    with open(manifest_path, newline='', encoding='utf-8') as f:
+        if manifest_path.lower().endswith(('.jsonl', '.ndjson')):
+            rows = (json.loads(line) for line in f if line.strip())
+        else:
+            rows = csv.DictReader(f)
+        for row in rows:
+            entry = normalize(row)
+            if entry:
+                yield entry
+
+def resolve_under(root, path):
+    """Chemin réel de `path` (relatif à `root`) ; lève ValueError s'il sort de `root`"""
+    root = os.path.realpath(root)
+    resolved = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, resolved]) != root:
+        raise ValueError(f"Chemin hors du répertoire autorisé: {path}")
+    return resolved
+
+def load_image_file(path):
+    """Ouvre une image locale en RGB réduite"""
+    with open(path, 'rb') as f:
+        return decode_image(f)
+
+def evaluate_directory(image_dir, manifest_path, model_ids, num_samples=65, output_dir=None, progress_callback=None):
+    """Évalue un ou plusieurs modèles sur un répertoire d'images géolocalisées
+
+    Les images sont lues au fil du manifeste et envoyées au planificateur
+    d'inférence par fenêtres, afin d'être regroupées en lots. Écrit
+    predictions.csv et report.json dans output_dir si fourni.
+    """
+    total_images = sum(1 for _ in read_evaluation_manifest(manifest_path))
+    # Nombre d'images en vol : de quoi remplir un lot du planificateur
+    window = max(1, config.max_batch_size // max(1, num_samples))
+
+    predictions_file = None
+    writer = None
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+        predictions_file = open(os.path.join(output_dir, 'predictions.csv'), 'w', newline='', encoding='utf-8')
+        writer = csv.writer(predictions_file)
+        writer.writerow(['model', 'image', 'true_lat', 'true_lon', 'pred_lat', 'pred_lon', 'distance_km', 'accuracy_percent'])
+
+    report = {
+        'image_dir': image_dir,
+        'manifest': manifest_path,
+        'num_samples': num_samples,
+        'total_images': total_images,
+        'models': {}
+    }
+    processed = 0
+
+    def collect(model_id, entry, future, distances):
+        samples = np.asarray(future.result(), dtype=float).reshape(-1, 2)
+        top = find_most_frequent_positions(samples, 1)
+        pred_lat, pred_lon = top[0]['coordinates'] if top else (float(samples[0, 0]), float(samples[0, 1]))
+        distance, accuracy = score_predictions(pred_lat, pred_lon, entry['lat'], entry['lon'])
+        distances.append(float(distance))
+        if writer:
+            writer.writerow([model_id, entry['image'], entry['lat'], entry['lon'],
+                             round(pred_lat, 6), round(pred_lon, 6), round(float(distance), 3), round(float(accuracy), 2)])
+
+    try:
+        for model_id in model_ids:
+            load_model(model_id)  # Ne pas compter le chargement dans le débit
+            distances = []
+            failures = 0
+            in_flight = []
+            start = time.monotonic()
+
+            def drain(limit):
+                nonlocal failures, processed
+                while len(in_flight) > limit:
+                    entry, future = in_flight.pop(0)
+                    try:
+                        collect(model_id, entry, future, distances)
+                    except Exception as e:
+                        failures += 1
+                        print(f"Erreur d'évaluation pour {entry['image']}: {e}")
+                    processed += 1
+                    if progress_callback:
+                        progress_callback(processed, total_images * len(model_ids))
+
+            for entry in read_evaluation_manifest(manifest_path):
+                try:
+                    # Les entrées du manifeste ne peuvent pas sortir du répertoire d'images
+                    img = load_image_file(resolve_under(image_dir, entry['image']))
+                    in_flight.append((entry, config.inference_scheduler.submit(model_id, img, num_samples)))
+                except Exception as e:
+                    failures += 1
+                    processed += 1
+                    print(f"Image illisible {entry['image']}: {e}")
+                    if progress_callback:
+                        progress_callback(processed, total_images * len(model_ids))
+                drain(window)
+            drain(0)
+
+            elapsed = time.monotonic() - start
+            model_report = summarize_distances(distances) or {'count': 0}
+            model_report['failed'] = failures
+            model_report['elapsed_s'] = round(elapsed, 3)
+            model_report['images_per_second'] = round(len(distances) / elapsed, 3) if elapsed > 0 else None
+            report['models'][model_id] = model_report
+    finally:
+        if predictions_file:
+            predictions_file.close()
+
+    if output_dir:
+        with open(os.path.join(output_dir, 'report.json'), 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    return report
+
+# Verrou libéré par le worker à la fin de l'évaluation
+evaluation_lock = threading.Lock()
+
+@app.route('/start_evaluation', methods=['POST'])
+def start_evaluation():
+    """Démarre une évaluation en masse sur un répertoire local d'images"""
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({'success': False, 'error': 'Aucune donnée reçue'}), 400
+
+        if config.evaluation_root is None:
+            return jsonify({'success': False, 'error': 'Évaluation désactivée (PLONK_EVALUATION_ROOT non défini)'}), 403
+
+        # Tous les chemins sont relatifs à la racine configurée et ne peuvent pas en sortir
+        try:
+            image_dir = resolve_under(config.evaluation_root, data.get('image_dir') or '')
+            manifest = resolve_under(config.evaluation_root, data.get('manifest') or '')
+            output_dir = resolve_under(config.evaluation_root, data['output_dir']) if data.get('output_dir') else None
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        if not os.path.isdir(image_dir):
+            return jsonify({'success': False, 'error': 'Répertoire d\'images introuvable'}), 400
+        if not os.path.isfile(manifest):
+            return jsonify({'success': False, 'error': 'Manifeste introuvable'}), 400
+
+        model_ids = data.get('models') or ['nicolas-dufour/PLONK_YFCC']
+        num_samples = int(data.get('num_samples', 65))
+
+        # Une seule évaluation à la fois, mise en file dans le pool d'analyses (voie lourde)
+        if not evaluation_lock.acquire(blocking=False):
+            return jsonify({'success': False, 'error': 'Une évaluation est déjà en cours'}), 409
+        try:
+            evaluation_id = config.job_store.create({'current': 0, 'total': 1, 'status': 'queued'}, prefix='eval_')
+
+            def run(job_id):
+                def on_progress(current, total):
+                    config.job_store.update(job_id, current=current, total=total)
+                try:
+                    config.job_store.update(job_id, status='running')
+                    report = evaluate_directory(image_dir, manifest, model_ids, num_samples, output_dir, on_progress)
+                    config.job_store.update(job_id, status='completed', results={'success': True, 'report': report})
+                except Exception as e:
+                    config.job_store.update(job_id, status='error', error=str(e))
+                finally:
+                    evaluation_lock.release()
+
+            config.analysis_pool.submit(evaluation_id, run, 'heavy')
+        except QueueFull as e:
+            config.job_store.delete(evaluation_id)
+            evaluation_lock.release()
+            return queue_full_response(e)
+        except Exception:
+            evaluation_lock.release()
+            raise
+
+        return jsonify({'success': True, 'analysis_id': evaluation_id})
+
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @app.route('/static/<path:filename>')
 def static_files(filename):
     return send_from_directory('static', filename)
@@ -509,4 +3151,10 @@ if __name__ == '__main__':
     os.makedirs('static', exist_ok=True)
     os.makedirs('templates', exist_ok=True)
     
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    # Préchargement en arrière-plan dès que le serveur écoute (dans le processus qui sert,
+    # pas dans le superviseur du rechargeur de debug)
+    debug = True
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        config.model_preloader.start(wait_for_address=('127.0.0.1', 5000))
+    
+    app.run(debug=debug, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,443 @@
+"""Banc d'essai reproductible des étapes d'analyse et des endpoints Flask
+
+Le pipeline PLONK et les fournisseurs de géocodage sont remplacés par des bouchons
+(pipeline synthétique, serveur HTTP local) afin de mesurer le coût propre de l'application.
+
+Exemple :
+    python benchmark.py --concurrency 1 4 16 --requests 64 --output bench.json
+    python benchmark.py --baseline bench.json
+"""
+import argparse
+import base64
+import io
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import requests
+from PIL import Image
+
+
+class StubPipeline:
+    """Pipeline PLONK synthétique : latence fixe par passage, encodage par image et latence par
+    échantillon, tirages autour de quelques foyers"""
+    def __init__(self, model_id, latency_ms=20.0, per_sample_us=50.0, seed=0, load_ms=0.0, encode_ms=5.0):
+        time.sleep(load_ms / 1000)  # Simule le chargement des poids
+        self.model_id = model_id
+        self.latency_ms = latency_ms
+        self.per_sample_us = per_sample_us
+        self.encode_ms = encode_ms
+        self._rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+        self.centres = np.array([[48.85, 2.35], [40.71, -74.0], [35.68, 139.69]])
+
+    def _draw(self, num_images, num_samples):
+        time.sleep((self.latency_ms + num_images * self.encode_ms) / 1000 + num_samples * self.per_sample_us / 1e6)
+        with self._lock:
+            centres = self.centres[self._rng.integers(0, len(self.centres), num_samples)]
+            noise = self._rng.normal(0, 0.5, (num_samples, 2))
+        return centres + noise
+
+    def __call__(self, images, batch_size=None, **kwargs):
+        if not isinstance(images, list):
+            images = [images]
+        return self._draw(len(images), batch_size or len(images))
+
+    def sample_many(self, images, counts):
+        """Comme TunedPipeline.sample_many : un encodage par image, un seul passage pour tout le lot"""
+        return self._draw(len(images), int(sum(counts)))
+
+
+class StubGeocoderHandler(BaseHTTPRequestHandler):
+    """Répond à /reverse au format Nominatim (format=json) ou Photon"""
+    latency_ms = 0.0
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        lat = float(params.get('lat', ['0'])[0])
+        lon = float(params.get('lon', ['0'])[0])
+        time.sleep(self.latency_ms / 1000)
+        if 'format' in params:
+            body = {'display_name': f"Stub {lat:.3f}, {lon:.3f}", 'lat': lat, 'lon': lon,
+                    'address': {'city': 'Stubville', 'country': 'Stubland', 'road': 'Rue du Banc'}}
+        else:
+            body = {'features': [{'properties': {'name': f"Stub {lat:.3f}, {lon:.3f}", 'city': 'Stubville',
+                                                 'country': 'Stubland', 'street': 'Rue du Banc'}}]}
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_geocoder_server(latency_ms):
+    """Démarre le serveur de géocodage bouchon ; retourne (serveur, url)"""
+    handler = type('Handler', (StubGeocoderHandler,), {'latency_ms': latency_ms})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def synthetic_jpeg(rng, width=1600, height=1200):
+    """Image JPEG synthétique (bruit lissé) : chaque appel produit une image distincte"""
+    small = rng.integers(0, 256, (height // 16, width // 16, 3), dtype=np.uint8)
+    img = Image.fromarray(small, 'RGB').resize((width, height), Image.BILINEAR)
+    buffer = io.BytesIO()
+    img.save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def percentiles(samples_s):
+    """Résumé p50/p95/p99 (ms) d'une liste de durées en secondes"""
+    values = np.asarray(samples_s, dtype=float) * 1000
+    if values.size == 0:
+        return {'count': 0}
+    return {
+        'count': int(values.size),
+        'mean_ms': round(float(values.mean()), 3),
+        'p50_ms': round(float(np.percentile(values, 50)), 3),
+        'p95_ms': round(float(np.percentile(values, 95)), 3),
+        'p99_ms': round(float(np.percentile(values, 99)), 3)
+    }
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def benchmark_stages(app_module, args, rng):
+    """Mesure chaque étape de l'analyse isolément"""
+    config = app_module.config
+    model_id = args.model
+    timings = {name: [] for name in ('decode', 'load_model_cold', 'load_model', 'inference', 'process_coordinates',
+                                     'find_most_frequent_positions', 'scoring', 'geocoding')}
+
+    # Chargement à froid : construction du pipeline par la fabrique du pool
+    for _ in range(args.repeats):
+        duration, _ = timed(config.model_pool.factory, model_id)
+        timings['load_model_cold'].append(duration)
+    app_module.load_model(model_id)
+
+    num_samples = args.iterations * args.samples
+    for _ in range(args.repeats):
+        jpeg = synthetic_jpeg(rng)
+        duration, img = timed(app_module.decode_image, jpeg)
+        timings['decode'].append(duration)
+
+        duration, pipeline = timed(app_module.load_model, model_id)
+        timings['load_model'].append(duration)
+
+        duration, coords = timed(pipeline, [img], batch_size=num_samples)
+        timings['inference'].append(duration)
+
+        duration, points = timed(app_module.process_coordinates, coords, num_samples)
+        timings['process_coordinates'].append(duration)
+
+        duration, clusters = timed(app_module.find_most_frequent_positions, points, args.final_results)
+        timings['find_most_frequent_positions'].append(duration)
+
+        true_lat, true_lon = 48.85, 2.35
+        start = time.perf_counter()
+        app_module.calculate_prediction_accuracy(clusters, true_lat, true_lon)
+        raw = np.asarray(points, dtype=float).reshape(-1, 2)
+        distances, _ = app_module.score_predictions(raw[:, 0], raw[:, 1], true_lat, true_lon)
+        app_module.summarize_distances(distances)
+        timings['scoring'].append(time.perf_counter() - start)
+
+        # Coordonnées distinctes : chaque géocodage manque le cache et interroge le serveur bouchon
+        lat, lon = rng.uniform(-60, 60), rng.uniform(-180, 180)
+        duration, _ = timed(app_module.get_location_info_detailed, lat, lon)
+        timings['geocoding'].append(duration)
+
+    return {name: percentiles(values) for name, values in timings.items()}
+
+
+def run_analysis_request(base_url, jpeg, args):
+    """Soumet une analyse et attend son résultat ; retourne (durée, statut)"""
+    params = {'model': args.model, 'max_results': args.samples}
+    if args.iterations > 1:
+        params.update(precision_mode='true', iterations=args.iterations, final_results=args.final_results)
+    start = time.perf_counter()
+    while True:
+        response = requests.post(f"{base_url}/start_analysis_upload", params=params, data=jpeg,
+                                 headers={'Content-Type': 'image/jpeg'}, timeout=60)
+        if response.status_code != 429:
+            break
+        time.sleep(float(response.headers.get('Retry-After', 1)))
+    if response.status_code != 200:
+        return time.perf_counter() - start, 'error'
+    analysis_id = response.json()['analysis_id']
+    while True:
+        response = requests.get(f"{base_url}/get_results/{analysis_id}", timeout=60)
+        if response.status_code != 202:
+            break
+        time.sleep(args.poll_interval)
+    status = 'ok' if response.status_code == 200 and response.json().get('success') else 'error'
+    return time.perf_counter() - start, status
+
+
+def run_location_request(base_url, rng_lock, rng):
+    """Demande les détails d'une position aléatoire (géocodage non mis en cache)"""
+    with rng_lock:
+        lat, lon = rng.uniform(-60, 60), rng.uniform(-180, 180)
+    start = time.perf_counter()
+    response = requests.post(f"{base_url}/get_location_details", json={'lat': lat, 'lon': lon}, timeout=60)
+    status = 'ok' if response.status_code == 200 and response.json().get('success') else 'error'
+    return time.perf_counter() - start, status
+
+
+def benchmark_throughput(base_url, args, rng, scheduler=None):
+    """Requêtes par seconde et latences de bout en bout pour chaque niveau de concurrence
+
+    Avec l'ordonnanceur d'inférence, mesure aussi l'occupation des lots (requêtes par lot).
+    """
+    results = []
+    rng_lock = threading.Lock()
+    for concurrency in args.concurrency:
+        images = [synthetic_jpeg(rng) for _ in range(args.requests)]
+        scenarios = {
+            'analysis': lambda i: run_analysis_request(base_url, images[i], args),
+            'location_details': lambda i: run_location_request(base_url, rng_lock, rng)
+        }
+        for endpoint, fn in scenarios.items():
+            before = scheduler.stats() if scheduler is not None else None
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                outcomes = list(executor.map(fn, range(args.requests)))
+            elapsed = time.perf_counter() - start
+            latencies = [duration for duration, status in outcomes if status == 'ok']
+            entry = {
+                'endpoint': endpoint,
+                'concurrency': concurrency,
+                'requests': args.requests,
+                'errors': sum(1 for _, status in outcomes if status != 'ok'),
+                'elapsed_s': round(elapsed, 3),
+                'rps': round(len(latencies) / elapsed, 2) if elapsed > 0 else None
+            }
+            entry.update(percentiles(latencies))
+            occupancy = ''
+            if before is not None:
+                after = scheduler.stats()
+                batches = after['batches'] - before['batches']
+                if batches:
+                    entry['batches'] = batches
+                    entry['requests_per_batch'] = round((after['requests'] - before['requests']) / batches, 2)
+                    entry['pipeline_calls'] = after['pipeline_calls'] - before['pipeline_calls']
+                    occupancy = f"  {entry['requests_per_batch']} req/lot"
+            results.append(entry)
+            print(f"{endpoint:17s} c={concurrency:<3d} {entry['rps']} req/s  p50 {entry.get('p50_ms')} ms  "
+                  f"p99 {entry.get('p99_ms')} ms  erreurs {entry['errors']}{occupancy}")
+    return results
+
+
+def install_stub_pipeline(app_module, args):
+    """Remplace la fabrique de pipelines du pool par le pipeline bouchon"""
+    if not args.real_models:
+        app_module.config.model_pool.factory = lambda model_id: StubPipeline(
+            model_id, args.stub_latency_ms, args.stub_per_sample_us, args.seed, args.stub_load_ms,
+            args.stub_encode_ms)
+
+
+def make_app_server(app_module, port=0):
+    """Serveur werkzeug multi-thread pour l'application (socket déjà à l'écoute au retour)"""
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    return make_server('127.0.0.1', port, app_module.app, threaded=True, request_handler=QuietHandler)
+
+
+def start_app_server(app_module):
+    """Démarre l'application dans un thread ; retourne (serveur, url)"""
+    server = make_app_server(app_module)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def serve(args):
+    """Processus enfant du démarrage à froid : import de l'application, écoute, puis préchargement"""
+    import app as app_module
+    install_stub_pipeline(app_module, args)
+    server = make_app_server(app_module, args.serve_port)
+    app_module.config.model_preloader.start()
+    server.serve_forever()
+
+
+def benchmark_cold_start(args, rng):
+    """Temps écoulé depuis le lancement d'un nouveau processus jusqu'à la première analyse réussie"""
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    base_url = f"http://127.0.0.1:{port}"
+    command = [sys.executable, os.path.abspath(__file__), '--serve-port', str(port), '--model', args.model,
+               '--stub-latency-ms', str(args.stub_latency_ms), '--stub-per-sample-us', str(args.stub_per_sample_us),
+               '--stub-load-ms', str(args.stub_load_ms), '--stub-encode-ms', str(args.stub_encode_ms),
+               '--seed', str(args.seed)]
+    if args.real_models:
+        command.append('--real-models')
+    image = 'data:image/jpeg;base64,' + base64.b64encode(synthetic_jpeg(rng)).decode('ascii')
+    payload = {'image': image, 'model': args.model, 'max_results': args.samples}
+
+    marks = {}
+    start = time.perf_counter()
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = start + args.cold_start_timeout
+        analysis_id = None
+        while time.perf_counter() < deadline and not ('first_result' in marks and 'ready' in marks):
+            try:
+                if 'http_up' not in marks and requests.get(f"{base_url}/health", timeout=1).status_code == 200:
+                    marks['http_up'] = time.perf_counter() - start
+                if 'ready' not in marks and requests.get(f"{base_url}/ready", timeout=1).status_code == 200:
+                    marks['ready'] = time.perf_counter() - start
+                if analysis_id is None:
+                    response = requests.post(f"{base_url}/start_analysis", json=payload, timeout=60)
+                    if response.status_code == 200 and response.json().get('success'):
+                        marks['first_start_analysis'] = time.perf_counter() - start
+                        analysis_id = response.json()['analysis_id']
+                elif 'first_result' not in marks:
+                    response = requests.get(f"{base_url}/get_results/{analysis_id}", timeout=60)
+                    if response.status_code == 200:
+                        marks['first_result'] = time.perf_counter() - start
+            except requests.RequestException:
+                pass
+            time.sleep(args.poll_interval)
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+    return {f"{name}_s": round(value, 3) for name, value in marks.items()}
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline):
+    """Affiche l'évolution des p50/p95 par rapport à un rapport précédent"""
+    print(f"\nComparaison avec {baseline.get('revision')} :")
+    for name, current in report['cold_start'].items():
+        previous = baseline.get('cold_start', {}).get(name)
+        if previous:
+            print(f"  démarrage {name:20s} x{current / previous:.2f}")
+    for name, current in report['stages'].items():
+        previous = baseline.get('stages', {}).get(name)
+        if not previous or not previous.get('p50_ms') or 'p50_ms' not in current:
+            continue
+        print(f"  {name:30s} p50 x{current['p50_ms'] / previous['p50_ms']:.2f}  "
+              f"p95 x{current['p95_ms'] / max(previous['p95_ms'], 1e-9):.2f}")
+    previous_rps = {(e['endpoint'], e['concurrency']): e.get('rps') for e in baseline.get('throughput', [])}
+    for entry in report['throughput']:
+        before = previous_rps.get((entry['endpoint'], entry['concurrency']))
+        if before and entry.get('rps'):
+            print(f"  {entry['endpoint']:17s} c={entry['concurrency']:<3d} req/s x{entry['rps'] / before:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Banc d'essai des étapes d'analyse et des endpoints PLONK")
+    parser.add_argument('--model', default='nicolas-dufour/PLONK_YFCC', help="Modèle utilisé")
+    parser.add_argument('--samples', type=int, default=65, help="Échantillons par itération")
+    parser.add_argument('--iterations', type=int, default=1, help="Itérations (mode précision si > 1)")
+    parser.add_argument('--final-results', type=int, default=5, help="Positions finales en mode précision")
+    parser.add_argument('--repeats', type=int, default=50, help="Répétitions par étape")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16], help="Niveaux de concurrence")
+    parser.add_argument('--requests', type=int, default=64, help="Requêtes par niveau de concurrence")
+    parser.add_argument('--poll-interval', type=float, default=0.01, help="Intervalle de scrutation des résultats (s)")
+    parser.add_argument('--stub-latency-ms', type=float, default=20.0, help="Latence fixe du pipeline bouchon")
+    parser.add_argument('--stub-per-sample-us', type=float, default=50.0, help="Latence par échantillon du bouchon")
+    parser.add_argument('--stub-encode-ms', type=float, default=5.0, help="Encodage d'une image par le bouchon")
+    parser.add_argument('--stub-load-ms', type=float, default=200.0, help="Durée de chargement du modèle bouchon")
+    parser.add_argument('--geocoder-latency-ms', type=float, default=5.0, help="Latence du géocodeur bouchon")
+    parser.add_argument('--cold-start-timeout', type=float, default=120.0, help="Délai max du démarrage à froid (s)")
+    parser.add_argument('--real-models', action='store_true', help="Utiliser les vrais modèles PLONK")
+    parser.add_argument('--seed', type=int, default=0, help="Graine des images et tirages synthétiques")
+    parser.add_argument('--output', help="Fichier JSON de résultats")
+    parser.add_argument('--baseline', help="Rapport JSON précédent à comparer")
+    parser.add_argument('--serve-port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve_port:
+        serve(args)
+        return
+
+    # Environnement isolé : fournisseurs bouchons, caches en mémoire, pas de cache de prédictions
+    geocoder, geocoder_url = start_geocoder_server(args.geocoder_latency_ms)
+    os.environ.update({
+        'PLONK_PHOTON_URL': geocoder_url,
+        'PLONK_NOMINATIM_URL': geocoder_url,
+        'PLONK_PHOTON_RATE': '100000',
+        'PLONK_NOMINATIM_RATE': '100000',
+        'PLONK_GEOCODE_CACHE_PATH': '',
+        'PLONK_PREDICTION_CACHE_MB': '0',
+        'PLONK_ANALYSIS_QUEUE_SIZE': str(max(args.concurrency) * 2)
+    })
+    os.environ.pop('PLONK_PREDICTION_CACHE_DIR', None)
+    os.environ.pop('PLONK_JOB_DB', None)
+    rng = np.random.default_rng(args.seed)
+
+    # Démarrage à froid dans un processus neuf, avant l'import de l'application ici
+    print("Mesure du démarrage à froid...")
+    cold_start = benchmark_cold_start(args, rng)
+    print("  " + "  ".join(f"{name} {value} s" for name, value in cold_start.items()))
+
+    import app as app_module
+    install_stub_pipeline(app_module, args)
+
+    print("Mesure des étapes...")
+    stages = benchmark_stages(app_module, args, rng)
+    for name, summary in stages.items():
+        print(f"  {name:30s} p50 {summary.get('p50_ms')} ms  p95 {summary.get('p95_ms')} ms  "
+              f"p99 {summary.get('p99_ms')} ms")
+
+    print("Mesure du débit...")
+    server, base_url = start_app_server(app_module)
+    try:
+        throughput = benchmark_throughput(base_url, args, rng, app_module.config.inference_scheduler)
+    finally:
+        server.shutdown()
+        geocoder.shutdown()
+
+    report = {
+        'revision': git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'settings': vars(args),
+        'cold_start': cold_start,
+        'stages': stages,
+        'throughput': throughput
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"Résultats enregistrés dans {args.output}")
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            compare(report, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
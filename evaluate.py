@@ -0,0 +1,31 @@
+"""Évaluation en masse des modèles PLONK sur un répertoire d'images géolocalisées
+
+Exemple :
+    python evaluate.py --images photos/ --manifest photos/labels.csv --output eval_out
+"""
+import argparse
+import json
+
+from app import config, evaluate_directory
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Évaluation PLONK sur un répertoire d'images annotées")
+    parser.add_argument('--images', required=True, help="Répertoire contenant les images")
+    parser.add_argument('--manifest', required=True, help="Manifeste CSV ou JSONL (colonnes image, lat, lon)")
+    parser.add_argument('--models', nargs='+', default=['nicolas-dufour/PLONK_YFCC'],
+                        help=f"Modèles à évaluer (ex. {', '.join(config.models_info)})")
+    parser.add_argument('--samples', type=int, default=65, help="Nombre d'échantillons par image")
+    parser.add_argument('--output', help="Répertoire de sortie (predictions.csv, report.json)")
+    args = parser.parse_args()
+
+    def on_progress(current, total):
+        print(f"\r{current}/{total} images", end='', flush=True)
+
+    report = evaluate_directory(args.images, args.manifest, args.models, args.samples, args.output, on_progress)
+    print()
+    print(json.dumps(report['models'], indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
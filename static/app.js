@@ -5,6 +5,7 @@ document.addEventListener("DOMContentLoaded", () => {
 class PLONKApp {
   constructor() {
     this.selectedImage = null;
+    this.selectedFile = null; // Fichier envoyé tel quel (multipart), sans base64
     this.map = null;
     this.markersGroup = null;
     this.currentPage = 1;
@@ -13,10 +14,13 @@ class PLONKApp {
     this.iterationTimer = null;
     this.currentAnalysisController = null;
     this.currentGeocodingControllers = new Map();
+    this.pendingLocationIds = new Set(); // Résultats en attente du géocodage groupé
+    this.maxGeocodingRetries = 10; // Nouvelles tentatives si les fournisseurs sont limités
     this.currentAnalysisId = null; // ID unique pour chaque analyse
     this.config = {
       api: {
         get_location_details: "/get_location_details",
+        get_location_details_batch: "/get_location_details_batch",
       },
       map: {
         defaultCenter: [48.8566, 2.3522],
@@ -120,13 +124,13 @@ class PLONKApp {
   }
 
   handleImageFile(file) {
-    const reader = new FileReader();
-    reader.onload = (e) => {
-      this.selectedImage = e.target.result;
-      this.showImagePreview(this.selectedImage);
-      document.getElementById("analyzeBtn").disabled = false;
-    };
-    reader.readAsDataURL(file);
+    if (this.selectedImage) {
+      URL.revokeObjectURL(this.selectedImage);
+    }
+    this.selectedFile = file;
+    this.selectedImage = URL.createObjectURL(file);
+    this.showImagePreview(this.selectedImage);
+    document.getElementById("analyzeBtn").disabled = false;
   }
 
   showImagePreview(imageSrc) {
@@ -142,7 +146,11 @@ class PLONKApp {
   }
 
   removeImage() {
+    if (this.selectedImage) {
+      URL.revokeObjectURL(this.selectedImage);
+    }
     this.selectedImage = null;
+    this.selectedFile = null;
     const preview = document.getElementById("imagePreview");
     const prompt = document.getElementById("uploadPrompt");
     const imageInput = document.getElementById("imageInput");
@@ -162,6 +170,11 @@ class PLONKApp {
     if (loadingText && loadingOverlay) {
       loadingText.textContent = text || "Analyse en cours...";
       loadingOverlay.style.display = "flex";
+      const loadingSubtext = document.getElementById("loadingSubtext");
+      if (loadingSubtext) {
+        loadingSubtext.textContent =
+          "Veuillez patienter pendant que l'IA détermine les positions possibles";
+      }
 
       // Le compteur d'itérations sera démarré manuellement avec l'analysis_id
       // après réception de la réponse du serveur
@@ -197,8 +210,11 @@ class PLONKApp {
         const response = await fetch(`/get_progress/${analysisId}`);
         const progress = await response.json();
         
-        if (loadingText && progress.status === 'running') {
+        if (loadingText && progress.status === 'queued') {
+          loadingText.textContent = `En file d'attente (position ${progress.queue_position || 1})...`;
+        } else if (loadingText && progress.status === 'running') {
           loadingText.textContent = `Mode Itératif - Itération ${progress.current}/${progress.total}...`;
+          this.showPartialResults(progress.partial_results);
         } else if (loadingText && progress.status === 'completed') {
           loadingText.textContent = "Finalisation des résultats...";
           if (this.iterationTimer) {
@@ -248,6 +264,91 @@ class PLONKApp {
     });
   }
 
+  showPartialResults(results) {
+    const loadingSubtext = document.getElementById("loadingSubtext");
+    const best = results && results[0];
+    if (loadingSubtext && best) {
+      loadingSubtext.textContent = `Meilleur candidat provisoire : ${best.latitude.toFixed(
+        4
+      )}, ${best.longitude.toFixed(4)} (${best.confidence} points)`;
+    }
+  }
+
+  waitForResultsStream(analysisId, isIterativeMode, totalIterations, signal) {
+    const fallbackToPolling = () => {
+      if (isIterativeMode) {
+        this.startIterationCounter(totalIterations, analysisId);
+      }
+      return this.waitForResults(analysisId);
+    };
+
+    if (!window.EventSource) {
+      return fallbackToPolling();
+    }
+
+    return new Promise((resolve, reject) => {
+      const source = new EventSource(`/stream/${analysisId}`);
+      const loadingText = document.getElementById("loadingText");
+      let settled = false;
+
+      const finish = () => {
+        settled = true;
+        source.close();
+      };
+
+      if (signal) {
+        signal.addEventListener("abort", () => {
+          if (!settled) {
+            finish();
+            reject(new DOMException("Analyse annulée", "AbortError"));
+          }
+        });
+      }
+
+      source.addEventListener("progress", (e) => {
+        const progress = JSON.parse(e.data);
+        if (!loadingText) {
+          return;
+        }
+        if (progress.status === "queued") {
+          loadingText.textContent = `En file d'attente (position ${
+            progress.queue_position || 1
+          })...`;
+        } else if (progress.status === "running" && isIterativeMode) {
+          loadingText.textContent = `Mode Itératif - Itération ${progress.current}/${progress.total}...`;
+        } else if (progress.status === "running") {
+          loadingText.textContent = "Analyse en cours...";
+        } else if (progress.status === "completed") {
+          loadingText.textContent = "Finalisation des résultats...";
+        }
+      });
+
+      // Résultats provisoires : afficher le meilleur candidat courant
+      source.addEventListener("partial", (e) => {
+        this.showPartialResults(JSON.parse(e.data).results);
+      });
+
+      source.addEventListener("result", (e) => {
+        finish();
+        resolve(JSON.parse(e.data));
+      });
+
+      source.addEventListener("failed", (e) => {
+        finish();
+        reject(new Error(JSON.parse(e.data).error || "Erreur inconnue"));
+      });
+
+      // Connexion SSE impossible ou interrompue : repli sur l'interrogation périodique
+      source.onerror = () => {
+        if (settled) {
+          return;
+        }
+        finish();
+        fallbackToPolling().then(resolve, reject);
+      };
+    });
+  }
+
   displayTestResults(testResults, testSummary, trueCoordinates) {
     const resultsContainer = document.getElementById("resultsContainer");
 
@@ -415,25 +516,40 @@ class PLONKApp {
 
     try {
       // Démarrer l'analyse et obtenir l'ID
-      const startResponse = await fetch('/start_analysis', {
+      const formData = new FormData();
+      formData.append("image", this.selectedFile);
+      formData.append(
+        "model",
+        document.querySelector('input[name="model"]:checked').value
+      );
+      formData.append("max_results", document.getElementById("maxResults").value);
+      formData.append(
+        "precision_mode",
+        document.getElementById("precisionMode").checked
+      );
+      formData.append("iterations", document.getElementById("iterations").value);
+      formData.append(
+        "final_results",
+        document.getElementById("finalResults").value
+      );
+      formData.append("early_stop", document.getElementById("earlyStop").checked);
+      formData.append("test_mode", document.getElementById("testMode").checked);
+      formData.append("true_lat", document.getElementById("trueLat").value);
+      formData.append("true_lon", document.getElementById("trueLon").value);
+
+      const startResponse = await fetch("/start_analysis_upload", {
         method: "POST",
-        headers: {
-          "Content-Type": "application/json",
-        },
         signal: this.currentAnalysisController.signal,
-        body: JSON.stringify({
-          image: this.selectedImage,
-          model: document.querySelector('input[name="model"]:checked').value,
-          max_results: document.getElementById("maxResults").value,
-          precision_mode: document.getElementById("precisionMode").checked,
-          iterations: document.getElementById("iterations").value,
-          final_results: document.getElementById("finalResults").value,
-          test_mode: document.getElementById("testMode").checked,
-          true_lat: document.getElementById("trueLat").value,
-          true_lon: document.getElementById("trueLon").value,
-        }),
+        body: formData,
       });
 
+      if (startResponse.status === 429) {
+        // File d'attente du serveur pleine
+        const retryAfter = startResponse.headers.get("Retry-After") || "quelques";
+        throw new Error(
+          `Serveur occupé, réessayez dans ${retryAfter} secondes.`
+        );
+      }
       if (!startResponse.ok) {
         throw new Error(`HTTP error! status: ${startResponse.status}`);
       }
@@ -441,13 +557,13 @@ class PLONKApp {
       const startData = await startResponse.json();
 
       if (startData.success && startData.analysis_id) {
-        // Démarrer le suivi en temps réel immédiatement
-        if (isIterativeMode) {
-          this.startIterationCounter(totalIterations, startData.analysis_id);
-        }
-        
-        // Attendre les résultats
-        const results = await this.waitForResults(startData.analysis_id);
+        // Suivre le progrès et attendre les résultats (SSE, avec repli sur l'interrogation périodique)
+        const results = await this.waitForResultsStream(
+          startData.analysis_id,
+          isIterativeMode,
+          totalIterations,
+          this.currentAnalysisController.signal
+        );
         
         if (results.success) {
           this.displayResults(results.results);
@@ -498,6 +614,7 @@ class PLONKApp {
       analysisId: this.currentAnalysisId,
     }));
     this.currentPage = 1;
+    this.pendingLocationIds.clear();
 
     if (results.length === 0) {
       resultsList.innerHTML = "<p>No results found.</p>";
@@ -550,23 +667,11 @@ class PLONKApp {
           </button>
         </div>`;
       marker.bindPopup(popupContent);
-
-      // Charger les détails de localisation en arrière-plan avec cache
-      const currentResult = this.allResults.find((r) => r.id === id);
-      const analysisId = currentResult
-        ? currentResult.analysisId
-        : this.currentAnalysisId;
-      // Utiliser l'index global au lieu de l'index local pour éviter les conflits
-      this.fetchLocationDetailsWithCache(
-        latitude,
-        longitude,
-        id,
-        globalIndex - 1,
-        true,
-        analysisId
-      );
     });
 
+    // Charger les détails de localisation de tous les résultats en une seule requête
+    this.fetchLocationDetailsBatch(this.allResults, this.currentAnalysisId);
+
     if (bounds.length > 0) {
       this.map.fitBounds(bounds, { padding: [50, 50] });
     }
@@ -644,6 +749,16 @@ class PLONKApp {
       });
       resultsList.appendChild(resultItem);
 
+      // Détails déjà chargés, ou en attente du géocodage groupé
+      const cacheKey = `${latitude.toFixed(6)},${longitude.toFixed(6)}_${id}`;
+      if (this.locationCache.has(cacheKey)) {
+        this.updateLocationDisplay(this.locationCache.get(cacheKey), id, false);
+        return;
+      }
+      if (this.pendingLocationIds.has(id)) {
+        return;
+      }
+
       // Passer l'index du résultat pour la priorisation
       const currentResult = this.allResults.find((r) => r.id === id);
       const analysisId = currentResult
@@ -660,13 +775,131 @@ class PLONKApp {
     });
   }
 
+  async fetchLocationDetailsBatch(results, analysisId, attempt = 0) {
+    const controller = new AbortController();
+    const requestKey = `batch_${analysisId}_${attempt}`;
+    this.currentGeocodingControllers.set(requestKey, controller);
+    results.forEach((result) => this.pendingLocationIds.add(result.id));
+    // Points non résolus car les fournisseurs sont limités : redemandés après retry_after
+    const throttled = [];
+    let retryAfter = 0;
+
+    try {
+      const response = await fetch(this.config.api.get_location_details_batch, {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        signal: controller.signal,
+        body: JSON.stringify({
+          points: results.map((result, index) => ({
+            lat: result.latitude,
+            lon: result.longitude,
+            result_index: index,
+          })),
+        }),
+      });
+      if (!response.ok || !response.body) {
+        throw new Error(`HTTP error! status: ${response.status}`);
+      }
+
+      // Lire le flux NDJSON : une ligne par résultat, dès qu'il est résolu
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) {
+          break;
+        }
+        buffer += decoder.decode(value, { stream: true });
+        let newlineIndex;
+        while ((newlineIndex = buffer.indexOf("\n")) >= 0) {
+          const line = buffer.slice(0, newlineIndex).trim();
+          buffer = buffer.slice(newlineIndex + 1);
+          if (!line) {
+            continue;
+          }
+          const data = JSON.parse(line);
+          if (!data.success && data.retry_after != null && results[data.result_index]) {
+            throttled.push(results[data.result_index]);
+            retryAfter = Math.max(retryAfter, data.retry_after);
+          } else {
+            this.handleBatchLocation(data, results, analysisId);
+          }
+        }
+      }
+    } catch (error) {
+      if (error.name === "AbortError") {
+        return; // Ne pas afficher d'erreur pour les annulations
+      }
+      console.error("Erreur lors du géocodage groupé:", error);
+    } finally {
+      this.currentGeocodingControllers.delete(requestKey);
+      const willRetry =
+        throttled.length > 0 && attempt < this.maxGeocodingRetries;
+      if (willRetry) {
+        this.retryLocationDetails(retryAfter, attempt, analysisId, () =>
+          this.fetchLocationDetailsBatch(throttled, analysisId, attempt + 1)
+        );
+      }
+      // Repli : requêtes individuelles pour les résultats restés sans réponse
+      if (analysisId === this.currentAnalysisId) {
+        results.forEach((result, index) => {
+          if (willRetry && throttled.includes(result)) {
+            return;
+          }
+          if (this.pendingLocationIds.has(result.id)) {
+            this.pendingLocationIds.delete(result.id);
+            this.fetchLocationDetailsWithCache(
+              result.latitude,
+              result.longitude,
+              result.id,
+              index,
+              true,
+              analysisId
+            );
+          }
+        });
+      }
+    }
+  }
+
+  handleBatchLocation(data, results, analysisId) {
+    // Vérifier que cette réponse correspond toujours à l'analyse actuelle
+    if (analysisId !== this.currentAnalysisId || !data.success) {
+      return;
+    }
+    const result = results[data.result_index];
+    if (!result) {
+      return;
+    }
+    this.pendingLocationIds.delete(result.id);
+    const cacheKey = `${result.latitude.toFixed(6)},${result.longitude.toFixed(
+      6
+    )}_${result.id}`;
+    this.locationCache.set(cacheKey, data.location_info);
+    this.updateLocationDisplay(data.location_info, result.id, true);
+  }
+
+  retryLocationDetails(retryAfter, attempt, analysisId, retry) {
+    if (attempt >= this.maxGeocodingRetries) {
+      return;
+    }
+    const delay = Math.max(retryAfter, 0.5) * 1000;
+    setTimeout(() => {
+      if (analysisId === this.currentAnalysisId) {
+        retry();
+      }
+    }, delay);
+  }
+
   async fetchLocationDetailsWithCache(
     lat,
     lon,
     resultId,
     resultIndex = 0,
     isForMap = false,
-    analysisId = null
+    analysisId = null,
+    attempt = 0
   ) {
     // Utiliser l'ID d'analyse actuel si non fourni
     const currentAnalysisId = analysisId || this.currentAnalysisId;
@@ -704,6 +937,19 @@ class PLONKApp {
         // Mettre en cache les données
         this.locationCache.set(cacheKey, data.location_info);
         this.updateLocationDisplay(data.location_info, resultId, isForMap);
+      } else if (data.retry_after != null) {
+        // Fournisseurs limités : redemander après le délai indiqué par le serveur
+        this.retryLocationDetails(data.retry_after, attempt, currentAnalysisId, () =>
+          this.fetchLocationDetailsWithCache(
+            lat,
+            lon,
+            resultId,
+            resultIndex,
+            isForMap,
+            currentAnalysisId,
+            attempt + 1
+          )
+        );
       }
     } catch (error) {
       if (error.name === "AbortError") {
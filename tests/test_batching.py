@@ -0,0 +1,85 @@
+"""Regroupement des inférences : passages partagés entre images et occupation des lots"""
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import AnalysisWorkerPool, InferenceScheduler  # noqa: E402
+
+
+class SlowPipeline:
+    """Pipeline factice : latence fixe par passage ; chaque « image » est la position (lat, lon) renvoyée"""
+    def __init__(self, latency_s=0.03):
+        self.latency_s = latency_s
+        self.passes = []
+
+    def __call__(self, images, batch_size=None):
+        return self.sample_many(images, [batch_size])
+
+    def sample_many(self, images, counts):
+        time.sleep(self.latency_s)
+        self.passes.append(list(counts))
+        return np.repeat(np.asarray(images, dtype=float).reshape(-1, 2), counts, axis=0)
+
+
+def test_distinct_images_share_one_pass():
+    pipeline = SlowPipeline(latency_s=0)
+    scheduler = InferenceScheduler(lambda model_id: pipeline, max_batch_size=1024, max_wait_ms=200)
+    images = [(10.0, 20.0), (-33.9, 151.2), (48.85, 2.35), (10.0, 20.0)]
+    futures = [scheduler.submit('model', image, 65, key=image) for image in images]
+    for image, future in zip(images, futures):
+        coords = future.result(timeout=10)
+        assert coords.shape == (65, 2)
+        assert np.all(coords == image)
+    # Trois images distinctes, la même image demandée deux fois : un seul passage
+    assert pipeline.passes == [[130, 65, 65]]
+    assert scheduler.stats()['pipeline_calls'] == 1
+
+
+def test_oversize_batch_is_split_across_passes():
+    pipeline = SlowPipeline(latency_s=0)
+    scheduler = InferenceScheduler(lambda model_id: pipeline, max_batch_size=100, max_wait_ms=200)
+    futures = [scheduler.submit('model', image, 70, key=image) for image in ((1.0, 1.0), (2.0, 2.0))]
+    assert np.all(futures[0].result(timeout=10) == (1.0, 1.0))
+    assert np.all(futures[1].result(timeout=10) == (2.0, 2.0))
+    assert all(sum(counts) <= 100 for counts in pipeline.passes)
+    assert sum(sum(counts) for counts in pipeline.passes) == 140
+
+
+def pipeline_calls(num_workers, num_jobs=48, num_samples=65):
+    """Lance des analyses rapides (une image distincte chacune) via le pool de workers ;
+    retourne le nombre de passages du pipeline"""
+    pipeline = SlowPipeline()
+    scheduler = InferenceScheduler(lambda model_id: pipeline, max_batch_size=1024, max_wait_ms=5)
+    pool = AnalysisWorkerPool(num_workers=num_workers, max_queue=num_jobs)
+    done = threading.Semaphore(0)
+
+    def analysis(job_id):
+        try:
+            image = (float(job_id), 0.0)
+            coords = scheduler.submit('model', image, num_samples, key=job_id).result(timeout=30)
+            assert np.all(coords == image)
+        finally:
+            done.release()
+
+    for i in range(num_jobs):
+        pool.submit(i, analysis)
+    for _ in range(num_jobs):
+        assert done.acquire(timeout=30)
+    stats = scheduler.stats()
+    assert stats['requests'] == num_jobs
+    assert sum(len(counts) for counts in pipeline.passes) == num_jobs
+    return stats['pipeline_calls']
+
+
+def test_pipeline_calls_drop_with_concurrency():
+    # Les analyses concurrentes d'images différentes partagent les passages du pipeline
+    calls = {workers: pipeline_calls(workers) for workers in (1, 4, 16)}
+    assert calls[1] == 48
+    assert calls[4] * 1.5 <= calls[1]
+    assert calls[16] * 1.5 <= calls[4]
@@ -0,0 +1,86 @@
+"""Régression du regroupement des positions face à l'implémentation d'origine"""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import PositionClusterer, find_most_frequent_positions  # noqa: E402
+
+
+def reference_find_most_frequent_positions(all_points, final_count, tolerance=0.01):
+    """Implémentation d'origine (regroupement glouton point par point)"""
+    grouped_points = []
+    for lat, lon in all_points:
+        for group in grouped_points:
+            group_lat, group_lon = group['center']
+            if abs(lat - group_lat) <= tolerance and abs(lon - group_lon) <= tolerance:
+                count = group['count'] + 1
+                group['center'] = ((group_lat * group['count'] + lat) / count,
+                                   (group_lon * group['count'] + lon) / count)
+                group['count'] = count
+                break
+        else:
+            grouped_points.append({'center': (lat, lon), 'count': 1})
+    grouped_points.sort(key=lambda x: x['count'], reverse=True)
+    return [{'coordinates': g['center'], 'confidence': g['count'], 'total_points': g['count']}
+            for g in grouped_points[:final_count]]
+
+
+def test_separated_clusters_match_reference():
+    rng = np.random.default_rng(0)
+    centres = (([10.0, 10.0], 40), ([-33.9, 151.2], 25), ([48.85, 2.35], 10))
+    points = np.concatenate([rng.normal(centre, 0.002, (count, 2)) for centre, count in centres])
+    rng.shuffle(points)
+    points = [tuple(p) for p in points]
+
+    expected = reference_find_most_frequent_positions(points, 3)
+    actual = find_most_frequent_positions(points, 3)
+
+    assert [g['confidence'] for g in actual] == [g['confidence'] for g in expected]
+    for got, want in zip(actual, expected):
+        assert got['coordinates'] == pytest.approx(want['coordinates'], abs=1e-9)
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('sigma', [0.005, 0.02, 0.05])
+def test_group_sizes_follow_reference_tolerance(seed, sigma):
+    # Les groupes ne doivent pas s'étendre au-delà de la tolérance (confiances du même ordre)
+    rng = np.random.default_rng(seed)
+    points = [tuple(p) for p in rng.normal([48.85, 2.35], sigma, (650, 2))]
+
+    expected = [g['confidence'] for g in reference_find_most_frequent_positions(points, 5)]
+    actual = [g['confidence'] for g in find_most_frequent_positions(points, 5)]
+
+    assert 0.6 <= actual[0] / expected[0] <= 1.5
+    assert 0.8 <= sum(actual) / sum(expected) <= 1.25
+
+
+def test_members_stay_within_tolerance_of_seed():
+    rng = np.random.default_rng(1)
+    points = rng.normal([48.85, 2.35], 0.02, (650, 2))
+    for group in find_most_frequent_positions(points, 5):
+        lat, lon = group['coordinates']
+        near = (np.abs(points[:, 0] - lat) <= 0.02) & (np.abs(points[:, 1] - lon) <= 0.02)
+        assert group['confidence'] <= near.sum()
+
+
+def test_antimeridian_cluster_is_not_split():
+    rng = np.random.default_rng(2)
+    points = np.column_stack([rng.normal(20.0, 0.002, 30), rng.normal(180.0, 0.002, 30)])
+    top = find_most_frequent_positions(points, 1)
+    assert top[0]['confidence'] == 30
+    assert abs(abs(top[0]['coordinates'][1]) - 180.0) < 0.01
+
+
+def test_incremental_matches_one_shot():
+    rng = np.random.default_rng(3)
+    points = rng.normal([48.85, 2.35], 0.03, (7 * 65, 2))
+
+    clusterer = PositionClusterer()
+    for chunk in np.split(points, 7):
+        clusterer.add(chunk)
+
+    assert clusterer.top(5) == find_most_frequent_positions(points, 5)